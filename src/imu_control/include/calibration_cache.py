@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+
+# Persistent imu calibrations, so a (re)started node can publish right away, and a check of a cached bias against live data.
+
+import json
+import math
+import os
+import time
+
+import numpy as np
+
+from running_stats import RunningStats
+
+
+class CalibrationCache(object):
+   """Calibrations in a JSON file, keyed by board and temperature band.
+
+   The bias of a MEMS imu depends on the temperature, so a calibration is only
+   reused within the same band of band_width degrees.
+   """
+
+   def __init__(self, path, band_width = 5.0):
+      self.path = os.path.expanduser(path)
+      self.band_width = band_width
+
+   def key(self, board, temperature):
+      band = int(math.floor(temperature / self.band_width))
+      return "%s/%g-%g" % (board, band * self.band_width, (band + 1) * self.band_width)
+
+   def _read(self):
+      try:
+         with open(self.path) as f:
+            return json.load(f)
+      except (IOError, OSError, ValueError):
+         return {} # no cache yet or unreadable, calibrate
+
+   def load(self, board, temperature):
+      # dict with mean, std, correction (lists), samples and stamp, None if there is no calibration for the band
+      return self._read().get(self.key(board, temperature))
+
+   def save(self, board, temperature, mean, std, correction, samples):
+      entries = self._read()
+      entries[self.key(board, temperature)] = {
+         'mean': list(map(float, mean)), 'std': list(map(float, std)), 'correction': list(map(float, correction)),
+         'samples': int(samples), 'temperature': float(temperature), 'stamp': time.time()}
+
+      # write a temporary file and rename it, a node killed while writing never leaves a broken cache
+      folder = os.path.dirname(self.path)
+      if folder and not os.path.isdir(folder):
+         os.makedirs(folder)
+      tmp = self.path + '.tmp'
+      with open(tmp, 'w') as f:
+         json.dump(entries, f, indent = 2, sort_keys = True)
+      os.rename(tmp, self.path)
+
+
+class BiasCheck(object):
+   """Compare a cached mean with live data, in windows of `window` samples while the imu is still.
+
+   A window counts as still if the std of every checked channel is below
+   still_ratio times the cached std (vibrations of a moving car raise it). In a
+   still window the bias has drifted if a channel mean is more than drift_sigma
+   cached std (at least std_floor) off the cached mean. Windows while moving are
+   skipped.
+   """
+
+   def __init__(self, mean, std, window = 200, channels = range(6), still_ratio = 2.0, drift_sigma = 3.0, std_floor = 1e-3):
+      self.channels = np.asarray(channels)
+      self.mean = np.asarray(mean, dtype = float)[self.channels]
+      self.std = np.maximum(np.asarray(std, dtype = float)[self.channels], std_floor)
+      self.window = window
+      self.still_ratio = still_ratio
+      self.drift_sigma = drift_sigma
+      self.stats = RunningStats(len(self.channels))
+      self.skipped = 0 # windows while moving
+      self.offset = None # window mean - cached mean of the last still window
+
+   def update(self, sample):
+      # add one sample, returns None until a still window was evaluated, then True if the bias holds, False if it drifted
+      self.stats.update(np.asarray(sample, dtype = float)[self.channels])
+      if self.stats.count < self.window:
+         return None
+
+      mean, std = self.stats.mean.copy(), self.stats.std
+      self.stats.reset()
+      if np.any(std > self.still_ratio * self.std):
+         self.skipped += 1
+         return None
+      self.offset = mean - self.mean
+      return bool(np.all(np.abs(self.offset) <= self.drift_sigma * self.std))
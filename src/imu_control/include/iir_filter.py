@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+
+# Streaming IIR filter of second-order sections for multi channel samples, e.g. the 7 imu values.
+# Run `python iir_filter.py` to compare it with the previous per sample implementation of IMUcalib.
+
+import numpy as np
+from scipy.signal import butter, sosfilt, sosfilt_zi
+
+
+class SosFilter(object):
+   """IIR filter of second-order sections with persistent state, one column per channel.
+
+   filter() processes a single sample in transposed direct form II with in place
+   numpy operations on preallocated arrays, so nothing is allocated per sample.
+   filter_batch() runs scipy's sosfilt over a block of samples in one vectorized
+   pass. Both share the state (same layout as the zi of sosfilt along axis 0), so
+   they can be mixed freely.
+   """
+
+   def __init__(self, sos, channels):
+      self.sos = np.atleast_2d(np.asarray(sos, dtype = float))
+      self.channels = channels
+      self.coeffs = [tuple(float(c) / section[3] for c in section) for section in self.sos] # normalized, a0 = 1
+      self.zi = np.zeros((len(self.sos), 2, channels)) # (sections, 2, channels)
+
+      # scratch arrays of filter()
+      self.x = np.zeros(channels)
+      self.y = np.zeros(channels)
+      self.tmp = np.zeros(channels)
+
+   @classmethod
+   def butter(cls, order, cutoff, fs, channels, btype = 'low'):
+      # butterworth filter with cutoff frequency in hz at sample rate fs
+      return cls(butter(order, cutoff / (fs / 2.0), btype = btype, output = 'sos'), channels)
+
+   def reset(self, value = 0.0):
+      # state of a filter that has seen `value` (scalar or one per channel) forever, no startup transient
+      value = np.broadcast_to(np.asarray(value, dtype = float), (self.channels,))
+      self.zi[...] = sosfilt_zi(self.sos)[:, :, np.newaxis] * value
+
+   def filter(self, sample, out = None):
+      # filter one sample of shape (channels,), the result is written to out (or an internal array that the next call overwrites)
+      x, y, tmp = self.x, self.y, self.tmp
+      np.copyto(x, sample)
+      for (b0, b1, b2, _, a1, a2), z in zip(self.coeffs, self.zi):
+         # y = b0 x + z0, z0 = b1 x - a1 y + z1, z1 = b2 x - a2 y
+         np.multiply(x, b0, out = y)
+         y += z[0]
+         np.multiply(x, b1, out = z[0])
+         z[0] += z[1]
+         np.multiply(y, a1, out = tmp)
+         z[0] -= tmp
+         np.multiply(x, b2, out = z[1])
+         np.multiply(y, a2, out = tmp)
+         z[1] -= tmp
+         x, y = y, x # output of this section is the input of the next
+      if out is None:
+         return x
+      np.copyto(out, x)
+      return out
+
+   def filter_batch(self, samples):
+      # filter samples of shape (n, channels) in one pass, returns the filtered (n, channels) array
+      filtered, self.zi = sosfilt(self.sos, samples, axis = 0, zi = self.zi)
+      return filtered
+
+
+if __name__ == '__main__':
+   import timeit
+
+   from scipy.signal import lfilter
+
+   fs, channels = 200.0, 7
+   rng = np.random.RandomState(0)
+   mean = np.array([0.0, 0.0, 9.81, 0.0, 0.0, 0.0, 35.0])
+   samples = mean + 0.05 * rng.randn(2000, channels)
+
+   # previous IMUcalib.butterworth_filter, two concatenate and two delete calls per sample
+   b, a = butter(2, 2.0 / (fs / 2), btype = 'low')
+   bb, aa = np.expand_dims(b, axis = 0), np.expand_dims(a, axis = 0)
+   state = {'ms': np.zeros((3, channels)), 'fm': np.zeros((2, channels))}
+
+   def previous(data):
+      state['ms'] = np.delete(np.concatenate(([data], state['ms']), axis = 0), (-1), axis = 0)
+      y = (np.dot(bb, state['ms']) - np.dot(aa[:, 1:], state['fm'])) / aa[:, 0]
+      state['fm'] = np.delete(np.concatenate((y, state['fm']), axis = 0), (-1), axis = 0)
+      return y[0]
+
+   sos_filter = SosFilter.butter(2, 2.0, fs, channels)
+
+   # same response as the transfer function, per sample and batched
+   expected = lfilter(b, a, samples, axis = 0)
+   streamed = np.array([sos_filter.filter(s).copy() for s in samples])
+   sos_filter.reset()
+   batched = np.concatenate([sos_filter.filter_batch(block) for block in np.array_split(samples, 10)])
+   assert np.allclose(streamed, expected) and np.allclose(batched, expected)
+
+   # state initialized from the mean: no startup transient
+   sos_filter.reset(mean)
+   first = sos_filter.filter_batch(samples[:200])
+   print("max deviation from the mean in the first second: {:.3f} without reset, {:.3f} with reset".format(
+      np.abs(expected[:200] - mean).max(), np.abs(first - mean).max()))
+
+   n = len(samples)
+   t_previous = timeit.timeit(lambda: [previous(s) for s in samples], number = 1) / n
+   t_filter = timeit.timeit(lambda: [sos_filter.filter(s) for s in samples], number = 1) / n
+   t_batch = timeit.timeit(lambda: sos_filter.filter_batch(samples[:200]), number = 10) / 2000
+   print("per sample: previous {:.1f} us, filter() {:.1f} us, filter_batch() of 200 {:.2f} us".format(
+      1e6 * t_previous, 1e6 * t_filter, 1e6 * t_batch))
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+
+# Batched imu samples in one std_msgs/Float64MultiArray, for high rate streams (fewer messages, callbacks and headers).
+#
+# The message holds N rows of FIELDS (layout dims 'samples' x 'fields', row major), the stamp of every
+# sample in seconds. unpack() turns a received message back into an (N, 7) array:
+#
+#    samples = unpack(msg)
+#    stamps, accel, gyro = samples[:, 0], samples[:, 1:4], samples[:, 4:7]
+
+import numpy as np
+from std_msgs.msg import Float64MultiArray, MultiArrayDimension
+
+FIELDS = ('stamp', 'accel_x', 'accel_y', 'accel_z', 'gyro_x', 'gyro_y', 'gyro_z')
+
+
+def pack(rows, msg = None):
+   # (N, 7) array -> Float64MultiArray, msg is reused if given
+   rows = np.asarray(rows, dtype = np.float64)
+   if msg is None:
+      msg = Float64MultiArray()
+      msg.layout.dim = [MultiArrayDimension(label = 'samples'), MultiArrayDimension(label = 'fields')]
+   n, fields = rows.shape
+   msg.layout.dim[0].size, msg.layout.dim[0].stride = n, n * fields
+   msg.layout.dim[1].size, msg.layout.dim[1].stride = fields, fields
+   msg.data = rows.ravel().tolist() # float64[] is serialized from a list in one struct.pack call
+   return msg
+
+
+def unpack(msg):
+   # Float64MultiArray of pack() -> (N, 7) array, a single conversion of the whole data
+   fields = msg.layout.dim[1].size if len(msg.layout.dim) > 1 else len(FIELDS)
+   return np.asarray(msg.data, dtype = np.float64)[msg.layout.data_offset:].reshape(-1, fields)
+
+
+class ImuBatcher(object):
+   """Collects samples into a preallocated (size, 7) array, publish(msg) is called with every full batch."""
+
+   def __init__(self, size, publish):
+      self.rows = np.empty((size, len(FIELDS)))
+      self.n = 0
+      self.publish = publish
+      self.msg = None
+
+   def add(self, stamp, accel, gyro):
+      row = self.rows[self.n]
+      row[0] = stamp
+      row[1:4] = accel
+      row[4:7] = gyro
+      self.n += 1
+      if self.n == len(self.rows):
+         self.flush()
+
+   def flush(self):
+      # publish the samples collected so far, e.g. at shutdown
+      if self.n == 0:
+         return
+      self.msg = pack(self.rows[:self.n], self.msg)
+      self.n = 0
+      self.publish(self.msg)
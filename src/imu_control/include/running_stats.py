@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+
+# Streaming mean and variance per channel for the imu calibration.
+# Run `python running_stats.py` to see when a simulated calibration converges, with and without bumps.
+
+import numpy as np
+
+
+class RunningStats(object):
+   """Mean and variance per channel, updated sample by sample (Welford), no samples are stored.
+
+   With reject_sigma > 0, once min_samples were accepted, a sample that is more
+   than reject_sigma standard deviations off the mean in one of the
+   reject_channels (default all) is rejected as a bump. std_floor keeps
+   quantized channels with (almost) zero variance from rejecting everything.
+   """
+
+   def __init__(self, channels, reject_sigma = 0.0, reject_channels = None, min_samples = 200, std_floor = 1e-3):
+      self.channels = channels
+      self.reject_sigma = reject_sigma
+      self.reject_channels = np.arange(channels) if reject_channels is None else np.asarray(reject_channels)
+      self.min_samples = min_samples
+      self.std_floor = std_floor
+      self.reset()
+
+   def reset(self):
+      self.count = 0
+      self.rejected = 0
+      self.consecutive_rejected = 0
+      self.mean = np.zeros(self.channels)
+      self.m2 = np.zeros(self.channels) # sum of squared deviations from the mean
+      self.delta = np.zeros(self.channels)
+      self.last_std = None
+
+   @property
+   def variance(self):
+      return self.m2 / (self.count - 1) if self.count > 1 else np.zeros(self.channels)
+
+   @property
+   def std(self):
+      return np.sqrt(self.variance)
+
+   def is_outlier(self, sample):
+      if self.reject_sigma <= 0 or self.count < self.min_samples:
+         return False
+      idx = self.reject_channels
+      limit = self.reject_sigma * np.maximum(self.std[idx], self.std_floor)
+      return bool(np.any(np.abs(sample[idx] - self.mean[idx]) > limit))
+
+   def update(self, sample):
+      # add one sample, returns False if it was rejected as an outlier
+      sample = np.asarray(sample, dtype = float)
+      if self.is_outlier(sample):
+         self.rejected += 1
+         self.consecutive_rejected += 1
+         return False
+
+      self.consecutive_rejected = 0
+      self.count += 1
+      np.subtract(sample, self.mean, out = self.delta)
+      self.mean += self.delta / self.count
+      self.m2 += self.delta * (sample - self.mean)
+      return True
+
+   def converged(self, rel_tol = 0.05, abs_tol = 1e-4):
+      """True if the std of every channel changed by less than rel_tol (or abs_tol) since the previous call.
+
+      Call it every few hundred samples; the first call after min_samples only
+      stores the reference.
+      """
+      if self.count < self.min_samples:
+         return False
+      std = self.std
+      last, self.last_std = self.last_std, std
+      if last is None:
+         return False
+      return bool(np.all(np.abs(std - last) <= np.maximum(rel_tol * last, abs_tol)))
+
+
+if __name__ == '__main__':
+   rng = np.random.RandomState(0)
+   mean = np.array([0.1, -0.2, 9.7, 0.01, -0.02, 0.0, 35.0])
+   noise = np.array([0.05, 0.05, 0.05, 0.01, 0.01, 0.01, 0.0])
+
+   for bumps in (False, True):
+      stats = RunningStats(len(mean), reject_sigma = 5.0, reject_channels = range(6))
+      n = 0
+      while n < 1600:
+         sample = mean + noise * rng.randn(len(mean))
+         if bumps and 220 <= n < 240:
+            sample[:3] += 2.0 # the carkit is bumped
+         stats.update(sample)
+         n += 1
+         if n % 100 == 0 and stats.converged():
+            break
+      print("bumps={}: converged after {} samples ({} rejected), mean error {:.4f}, std error {:.4f}".format(
+         bumps, n, stats.rejected, np.abs(stats.mean - mean).max(), np.abs(stats.std - noise).max()))
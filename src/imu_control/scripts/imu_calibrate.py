@@ -3,10 +3,20 @@
 import rospy
 import numpy as np
 from sensor_msgs.msg import Imu
-from std_msgs.msg import Float32MultiArray, Int16MultiArray
-from scipy.signal import butter, filtfilt
+from std_msgs.msg import Float32MultiArray, Int16MultiArray, Float64MultiArray
 from collections import deque
+import threading
+import sys
+import os
+import rospkg
 
+# add the include path of the package so that interpeter can find the modules
+sys.path.append(os.path.join(rospkg.RosPack().get_path('imu_control'), 'include'))
+
+from iir_filter import SosFilter
+from running_stats import RunningStats
+from calibration_cache import CalibrationCache, BiasCheck
+from imu_batch import ImuBatcher
 
 
           
@@ -20,14 +30,33 @@ class IMUcalib:
       self.imu_msg.header.seq = 0
 
       # calibrated
-      self.n_samples = 1600
+      # streaming statistics: finished as soon as the std of all channels is stable (checked every calib_check_every samples),
+      # after calib_max_samples at the latest; samples more than outlier_sigma std off the mean are rejected as bumps (0 = off)
+      self.n_samples = rospy.get_param('~calib_max_samples', 1600)
+      self.check_every = rospy.get_param('~calib_check_every', 100)
+      self.tolerance = rospy.get_param('~calib_tolerance', 0.05) # relative change of the std between checks
       self.is_calibrated = False
-      self.data = []
+      self.stats = RunningStats(7, reject_sigma = rospy.get_param('~outlier_sigma', 5.0), reject_channels = range(6), # not temperature
+                                min_samples = rospy.get_param('~calib_min_samples', 200))
       self.mean_values = None
       self.std_values = None
       self.target_values = np.array([0.0, 0.0, 9.81, 0.0, 0.0, 0.0, 0.0]) # accel_x, accel_y, accel_z, ang_x, ang_y, ang_z, temperature
       self.correction = []
       
+      # calibrations are cached on disk per board and temperature band, a (re)started node publishes right away
+      # and checks the cached bias against live data while the carkit stands still, it recalibrates only if it drifted
+      cache_path = rospy.get_param('~calibration_cache', '~/.ros/imu_calibration.json') # '' = always calibrate
+      self.cache = CalibrationCache(cache_path, rospy.get_param('~temperature_band', 5.0)) if cache_path else None
+      # board_id: identifies this imu board in the cache (e.g. its serial number), required with a cache, a shared
+      # default would mix up the calibrations of different boards
+      self.board = rospy.get_param('~board_id', '')
+      if self.cache is not None and not self.board:
+         err_msg = "~board_id is required to cache calibrations, set it to an identifier of this imu board or set calibration_cache to '' to always calibrate"
+         rospy.logerr(err_msg)
+         raise ValueError(err_msg)
+      self.cache_checked = False
+      self.bias_check = None
+      
       # https://www.samproell.io/posts/yarppg/yarppg-live-digital-filter/
       # filter measurements
       # init butterworth filter
@@ -35,21 +64,21 @@ class IMUcalib:
       self.apply_filter = apply_filter
       
       fs = 200.0 # sample rate hz
-      nyq = fs/2 # nyquist frequency
       cutoff_frequency = 2.0 # cutoff frequency in hz
-      norm_freq = cutoff_frequency / nyq # normalized from 0 to 1
       order = 2
       
-      # numerator (b) and denominator (a) polynomials of the IIR filter.
-      b, a = butter(order, norm_freq, btype='low', analog=False)
+      # second-order sections with persistent state, see include/iir_filter.py
+      self.filter = SosFilter.butter(order, cutoff_frequency, fs, len(self.target_values))
+      # the filter state is shared by the subscriber (reset on a recalibration) and the batch timer thread
+      self.filter_lock = threading.Lock()
       
-      self.ms = np.zeros(shape = (len(b), len(self.target_values))) # measurements (3,7)
-      self.fm = np.zeros(shape = (len(a) - 1, len(self.target_values))) # filtered measurements (2,7)
-      
-      self.b, self.a = np.expand_dims(b, axis=0), np.expand_dims(a, axis=0) # (3,) -> (1,3)
+      # batch_rate: filter the samples received since the last run in one vectorized pass at this rate (hz),
+      # 0 filters every sample in the callback
+      self.batch_rate = rospy.get_param('~batch_rate', 0.0)
+      self.backlog = deque() # (stamp, data) waiting for the batch timer
       
       # info message
-      rospy.loginfo("calibrating imu with %d samples" %self.n_samples)
+      rospy.loginfo("calibrating imu with up to %d samples" %self.n_samples)
       rospy.logwarn("do not move the carkit during the calibration process")
       
       # subscribe to imu Float32MultiArray
@@ -58,54 +87,136 @@ class IMUcalib:
       # publish as imu sensor_msg
       self.imu_pub = rospy.Publisher('/imu_calibrated', Imu, queue_size=200)
       self.filter_pub = rospy.Publisher('/imu_filtered', Imu, queue_size=200)
+      
+      # batch_size: also publish batches of this many samples (Float64MultiArray, see include/imu_batch.py)
+      # on /imu_calibrated/batch and /imu_filtered/batch, e.g. for foxglove, 0 = off
+      self.batch_size = rospy.get_param('~batch_size', 0)
+      self.calibrated_batch = self.filtered_batch = None
+      if self.batch_size > 0:
+         calibrated_batch_pub = rospy.Publisher('/imu_calibrated/batch', Float64MultiArray, queue_size=10)
+         filtered_batch_pub = rospy.Publisher('/imu_filtered/batch', Float64MultiArray, queue_size=10)
+         self.calibrated_batch = ImuBatcher(self.batch_size, calibrated_batch_pub.publish)
+         self.filtered_batch = ImuBatcher(self.batch_size, filtered_batch_pub.publish)
+         rospy.on_shutdown(self.calibrated_batch.flush) # publish the partial last batches
+         rospy.on_shutdown(self.filtered_batch.flush)
+      
+      if self.batch_rate > 0:
+         rospy.Timer(rospy.Duration(1.0 / self.batch_rate), self.drain_backlog)
 
    def shutdown(self):
       self.imu_pub.unregister()
       self.filter_pub.unregister()
         
    def calibrate(self, msg):
-      self.data += [msg.data]
-      
-      if len(self.data) == self.n_samples:
-         self.data = np.array(self.data)
-         self.mean_values = np.mean(self.data, axis = 0)
-         self.std_values = np.std(self.data, axis = 0)
-         self.correction = self.target_values - self.mean_values
-         self.correction[-1] = 0.0 # no correction on temerature
+      if not self.stats.update(msg.data):
+         if self.stats.consecutive_rejected > self.stats.min_samples: # not a bump, the carkit was moved
+            rospy.logwarn("imu moved during calibration, restarting")
+            self.stats.reset()
+         return
+      
+      n = self.stats.count
+      if n >= self.n_samples or (n % self.check_every == 0 and self.stats.converged(self.tolerance)):
+         rospy.loginfo("calibration finished after %d samples (%d rejected)" %(n, self.stats.rejected))
+         self.apply_calibration(self.stats.mean.copy(), self.stats.std)
          
-         # info message
-         rospy.loginfo("calibration finished")
-         rospy.loginfo("mean: accel_x: %.2f, accel_y: %.2f, accel_z: %.2f, ang_x: %.2f, ang_y: %.2f, ang_z: %.2f, temperature: %.2f" %tuple(self.mean_values))
-         rospy.loginfo("std: accel_x: %.2f, accel_y: %.2f, accel_z: %.2f, ang_x: %.2f, ang_y: %.2f, ang_z: %.2f, temperature: %.2f" %tuple(self.std_values))
+         if self.cache is not None:
+            try:
+               self.cache.save(self.board, self.mean_values[-1], self.mean_values, self.std_values, self.correction, n)
+            except (IOError, OSError) as e:
+               rospy.logwarn("could not save the calibration: %s" %e)
          
-         if self.apply_filter:
-           rospy.loginfo("applying butterworth filter")
+   def load_cached(self, temperature):
+      # use the cached calibration of the current temperature band, False if there is none
+      cached = self.cache.load(self.board, temperature)
+      if cached is None:
+         rospy.loginfo("no cached calibration for %s" %self.cache.key(self.board, temperature))
+         return False
+      
+      rospy.loginfo("using cached calibration %s, verifying it while the carkit stands still" %self.cache.key(self.board, temperature))
+      self.apply_calibration(np.array(cached['mean']), np.array(cached['std']))
+      self.bias_check = BiasCheck(self.mean_values, self.std_values)
+      return True
+      
+   def check_bias(self, data):
+      # background check of a cached calibration, recalibrate if the bias drifted
+      result = self.bias_check.update(data)
+      if result is None:
+         return
+      self.bias_check = None
+      if result:
+         rospy.loginfo("cached calibration verified")
+         return
+      rospy.logwarn("cached imu bias drifted, recalibrating, do not move the carkit")
+      self.is_calibrated = False
+      self.stats.reset()
+      
+   def apply_calibration(self, mean, std):
+      self.mean_values = mean
+      self.std_values = std
+      correction = self.target_values - self.mean_values
+      correction[-1] = 0.0 # no correction on temerature
+      self.correction = correction # swapped in complete, the batch timer may read it any time
+      self.is_calibrated = True
+      
+      # info message
+      rospy.loginfo("mean: accel_x: %.2f, accel_y: %.2f, accel_z: %.2f, ang_x: %.2f, ang_y: %.2f, ang_z: %.2f, temperature: %.2f" %tuple(self.mean_values))
+      rospy.loginfo("std: accel_x: %.2f, accel_y: %.2f, accel_z: %.2f, ang_x: %.2f, ang_y: %.2f, ang_z: %.2f, temperature: %.2f" %tuple(self.std_values))
+      
+      if self.apply_filter:
+        rospy.loginfo("applying butterworth filter")
+        # start from the calibrated mean, as if the filter had seen it forever: no startup transient
+        with self.filter_lock:
+          self.filter.reset(self.mean_values + self.correction)
          
    def butterworth_filter(self, data):
-      # Filter incoming data with standard difference equations.
-
-      self.ms = np.concatenate(([data], self.ms), axis = 0)
-      self.ms = np.delete(self.ms, (-1), axis = 0)
-
-      y = np.dot(self.b, self.ms) - np.dot(self.a[:,1:], self.fm)
-      y = y / self.a[:,0]
-
-      self.fm = np.concatenate((y, self.fm), axis = 0)
-      self.fm = np.delete(self.fm, (-1), axis = 0)
+      # Filter one sample, no allocation per sample
+      with self.filter_lock:
+         return self.filter.filter(data)
       
-      return y[0]
+   def drain_backlog(self, event):
+      # filter all samples received since the last run in one pass and publish them in order
+      n = len(self.backlog)
+      if n == 0:
+         return
+      samples = [self.backlog.popleft() for _ in range(n)]
+      data = np.array([d for _, d in samples]) + self.correction # (n,7)
+      filtered = None
+      if self.apply_filter:
+         with self.filter_lock:
+            filtered = self.filter.filter_batch(data)
       
+      for i, (stamp, _) in enumerate(samples):
+         self.publish(stamp, data[i], None if filtered is None else filtered[i])
       
    def imu_callback(self, msg):
       
-      if len(self.data) < self.n_samples:
-         self.calibrate(msg)
+      if not self.is_calibrated:
+         if self.cache is not None and not self.cache_checked:
+            self.cache_checked = True
+            calibrated = self.load_cached(msg.data[-1])
+         else:
+            calibrated = False
+         if not calibrated:
+            self.calibrate(msg)
+            return
+      
+      if self.bias_check is not None:
+         self.check_bias(msg.data)
+      
+      stamp = rospy.Time.now() # add timestamp
+      
+      if self.batch_rate > 0:
+         self.backlog.append((stamp, msg.data))
          return
       
       # apply correction
       data = np.array(msg.data) + self.correction 
-
-      self.imu_msg.header.stamp = rospy.Time.now() # add timestamp
+      
+      self.publish(stamp, data, self.butterworth_filter(data) if self.apply_filter else None)
+      
+   def publish(self, stamp, data, filtered):
+      
+      self.imu_msg.header.stamp = stamp
       self.imu_msg.header.seq += 1
       
       # publish calibrated imu data
@@ -118,12 +229,14 @@ class IMUcalib:
 
       try:
         self.imu_pub.publish(self.imu_msg)
+        if self.calibrated_batch is not None:
+          self.calibrated_batch.add(stamp.to_sec(), data[0:3], data[3:6])
       except rospy.ROSException as e:
         print("Error publishing calibrated IMU data:", e)
         
-      # apply mean filter
-      if self.apply_filter:
-        data = self.butterworth_filter(data)
+      # filtered measurements
+      if filtered is not None:
+        data = filtered
 
         # publish filtered imu data
         self.imu_msg.linear_acceleration.x = data[0]
@@ -137,6 +250,8 @@ class IMUcalib:
       
         try:
           self.filter_pub.publish(self.imu_msg)
+          if self.filtered_batch is not None:
+            self.filtered_batch.add(stamp.to_sec(), data[0:3], data[3:6])
         except rospy.ROSException as e:
           print("Error publishing filtered IMU data:", e)
         
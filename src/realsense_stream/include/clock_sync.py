@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+
+# Mapping of librealsense frame timestamps (device clock, ms) to ROS time.
+# Run `python3 clock_sync.py` for a simulation of the stamp error with drift and delivery jitter.
+
+from collections import deque
+
+
+class ClockSync:
+    """Continuously estimated offset between the device clock and the host (ROS) clock.
+
+    Every frame gives one sample host arrival time - device timestamp, which is
+    the true offset plus the (always positive) transport and scheduling delay.
+    The minimum over the last `window` seconds is the sample with the least
+    delay, it follows clock drift as old samples leave the window. A sample that
+    differs from the estimate by more than `reset_threshold` seconds (device
+    reset, clock jump, time domain change) restarts the estimation.
+    """
+
+    def __init__(self, window=5.0, reset_threshold=0.5):
+        self.window = window
+        self.reset_threshold = reset_threshold
+        self.samples = deque() # (host time, offset), offsets increasing: sliding window minimum
+        self.resets = 0
+
+    @property
+    def offset(self):
+        # host - device in seconds, None before the first sample
+        return self.samples[0][1] if self.samples else None
+
+    def update(self, device_ms, host_s):
+        # feed the device timestamp of a frame and its arrival time, returns the host time of the capture
+        sample = host_s - device_ms * 1e-3
+        if self.samples and abs(sample - self.samples[0][1]) > self.reset_threshold:
+            self.samples.clear()
+            self.resets += 1
+
+        while self.samples and self.samples[-1][1] >= sample:
+            self.samples.pop()
+        self.samples.append((host_s, sample))
+        while host_s - self.samples[0][0] > self.window:
+            self.samples.popleft()
+        return self.to_host(device_ms)
+
+    def to_host(self, device_ms):
+        return device_ms * 1e-3 + self.offset
+
+
+if __name__ == '__main__':
+    import numpy as np
+
+    # device clock 50 ppm fast, 30 fps, delivery delay 8 ms + exponential jitter (USB, scheduling)
+    rng = np.random.RandomState(0)
+    sync = ClockSync()
+    naive, synced = [], []
+    for i in range(30 * 60):
+        capture = 1000.0 + i / 30.0
+        device_ms = 1e3 * (capture * (1 + 50e-6) - 1000.0)
+        arrival = capture + 0.008 + rng.exponential(0.004)
+        naive.append(arrival - capture)
+        synced.append(sync.update(device_ms, arrival) - capture)
+
+    naive, synced = 1e3 * np.array(naive), 1e3 * np.array(synced)
+    for name, err in (('arrival stamp', naive), ('clock sync', synced)):
+        print("{:>14}: stamp error mean {:6.2f} ms, jitter (std) {:5.2f} ms, max {:6.2f} ms".format(
+            name, err.mean(), err.std(), err.max()))
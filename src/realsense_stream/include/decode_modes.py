@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+
+# Reduced resolution, grayscale and ROI decoding of JPEG frames.
+# Run `python3 decode_modes.py [image]` to compare the decode CPU time of all modes.
+
+import time
+
+import cv2
+import numpy as np
+
+# mode: (imdecode flag, downscale factor)
+DECODE_MODES = {
+    'color': (cv2.IMREAD_COLOR, 1),
+    'color_2': (cv2.IMREAD_REDUCED_COLOR_2, 2),
+    'color_4': (cv2.IMREAD_REDUCED_COLOR_4, 4),
+    'color_8': (cv2.IMREAD_REDUCED_COLOR_8, 8),
+    'gray': (cv2.IMREAD_GRAYSCALE, 1),
+    'gray_2': (cv2.IMREAD_REDUCED_GRAYSCALE_2, 2),
+    'gray_4': (cv2.IMREAD_REDUCED_GRAYSCALE_4, 4),
+    'gray_8': (cv2.IMREAD_REDUCED_GRAYSCALE_8, 8),
+}
+
+# CPU time of the calling thread, process time on python < 3.7
+cpu_time = getattr(time, 'thread_time', time.process_time)
+
+
+class JpegDecoder:
+    """Decode JPEG bytes with one of DECODE_MODES and crop a region of interest.
+
+    The ROI (x, y, width, height) is given in full resolution pixels and scaled
+    to the reduced image, the crop is a view and costs nothing. The reduced
+    modes let libjpeg skip most of the IDCT work instead of resizing afterwards.
+    """
+
+    def __init__(self, mode='color', roi=None):
+        if mode not in DECODE_MODES:
+            raise ValueError(f"Unknown decode mode {mode}. Valid options are: {list(DECODE_MODES)}")
+        self.mode = mode
+        self.flag, self.factor = DECODE_MODES[mode]
+        self.roi = None
+        if roi:
+            x, y, w, h = roi
+            f = self.factor
+            self.roi = (slice(y // f, (y + h) // f), slice(x // f, (x + w) // f))
+
+    def convert(self, image):
+        # same output as decode() for a raw BGR image, e.g. from the shared memory transport
+        if self.flag in (cv2.IMREAD_GRAYSCALE, cv2.IMREAD_REDUCED_GRAYSCALE_2,
+                         cv2.IMREAD_REDUCED_GRAYSCALE_4, cv2.IMREAD_REDUCED_GRAYSCALE_8):
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        if self.factor > 1:
+            image = cv2.resize(image, None, fx=1.0 / self.factor, fy=1.0 / self.factor, interpolation=cv2.INTER_AREA)
+        return image if self.roi is None else image[self.roi]
+
+    def decode(self, data):
+        # data: bytes of the message, wrapped without a copy; None if decoding failed
+        image = cv2.imdecode(np.frombuffer(data, np.uint8), self.flag)
+        if image is None or self.roi is None:
+            return image
+        return image[self.roi]
+
+
+if __name__ == '__main__':
+    import sys
+
+    from frame_sources import SyntheticSource
+
+    if len(sys.argv) > 1:
+        image = cv2.imread(sys.argv[1], cv2.IMREAD_COLOR)
+    else:
+        image = SyntheticSource(1280, 720, 0, realtime=False).read()
+    data = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, 95])[1].tobytes()
+
+    repeats = 50
+    baseline = None
+    h, w = image.shape[:2]
+    for mode in DECODE_MODES:
+        decoder = JpegDecoder(mode, roi=(w // 4, h // 4, w // 2, h // 2))
+        t0 = cpu_time()
+        for _ in range(repeats):
+            out = decoder.decode(data)
+        cpu_ms = 1e3 * (cpu_time() - t0) / repeats
+        baseline = baseline or cpu_ms
+        print("{:>8}: {:6.2f} ms cpu/frame, saving {:5.1f} %, roi {}".format(mode, cpu_ms, 100 * (1 - cpu_ms / baseline), out.shape))
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+
+# Preallocated image buffers for the camera path.
+# Run `python3 frame_buffers.py` for the per frame allocation benchmark at 1080p.
+
+import queue
+
+import numpy as np
+
+
+class BufferPool:
+    """Fixed set of preallocated image buffers, reused for every frame.
+
+    copy_in() copies a frame (e.g. the librealsense frame memory) into a free
+    buffer, so the source can be released right away and no array is
+    allocated per frame. Buffers go back to the pool with release().
+    """
+
+    def __init__(self, shape, count, dtype=np.uint8):
+        self.shape = tuple(shape)
+        self.free = queue.LifoQueue() # most recently used buffer first, it is still in cache
+        for _ in range(count):
+            self.free.put(np.empty(self.shape, dtype))
+
+    def acquire(self):
+        # free buffer or None if all are in use
+        try:
+            return self.free.get_nowait()
+        except queue.Empty:
+            return None
+
+    def release(self, buf):
+        self.free.put(buf)
+
+    def copy_in(self, src):
+        buf = self.acquire()
+        if buf is not None:
+            np.copyto(buf, src.reshape(self.shape))
+        return buf
+
+
+if __name__ == '__main__':
+    import time
+    import tracemalloc
+
+    import cv2
+
+    from frame_sources import SyntheticSource
+
+    frames = 30
+    camera = SyntheticSource(1920, 1080, 0, realtime=False).read() # stands in for the librealsense frame memory
+    pool = BufferPool(camera.shape, 3)
+
+    def old_path():
+        # the publisher before: asanyarray is a view, np.array() copies the encoded buffer before tobytes() copies it again
+        color_image = np.asanyarray(camera)
+        _, img_encoded = cv2.imencode('.jpg', color_image)
+        return np.array(img_encoded).tobytes()
+
+    def sequential_path():
+        _, img_encoded = cv2.imencode('.jpg', camera)
+        return img_encoded.tobytes()
+
+    def pipelined_path():
+        # frame copied into a pool buffer so librealsense gets it back before encoding, no allocation but a full frame copy
+        buf = pool.copy_in(camera)
+        _, img_encoded = cv2.imencode('.jpg', buf)
+        pool.release(buf)
+        return img_encoded.tobytes()
+
+    for name, path, frame_copy in (('old', old_path, 0), ('sequential', sequential_path, 0), ('pipelined', pipelined_path, camera.nbytes)):
+        path() # warm up
+        peaks, elapsed = [], 0.0
+        for _ in range(frames):
+            tracemalloc.start()
+            t0 = time.perf_counter()
+            payload = path()
+            elapsed += time.perf_counter() - t0
+            peaks.append(tracemalloc.get_traced_memory()[1]) # bytes allocated at the same time during one frame
+            tracemalloc.stop()
+        print("{:>10}: {:.2f} ms/frame, peak allocation {:.2f} MB/frame, frame copy {:.2f} MB, payload {:.0f} kB".format(
+            name, 1e3 * elapsed / frames, np.mean(peaks) / 1e6, frame_copy / 1e6, len(payload) / 1e3))
@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+
+import threading
+
+
+class LatestSlot:
+    """Single item hand-over between a subscriber callback and worker threads.
+
+    put() replaces an item that was not taken yet (latest wins) and returns
+    True in that case, so a slow consumer never works through a backlog.
+    """
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.item = None
+        self.closed = False
+
+    def put(self, item):
+        with self.cond:
+            replaced = self.item is not None
+            self.item = item
+            self.cond.notify()
+        return replaced
+
+    def get(self, timeout=None):
+        # next item, None on timeout or once closed
+        with self.cond:
+            if self.item is None and not self.closed:
+                self.cond.wait(timeout)
+            item, self.item = self.item, None
+            return item
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
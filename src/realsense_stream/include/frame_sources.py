@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+
+# Frame sources for the JPEG publisher: RealSense camera, video file / image directory and synthetic frames.
+# Run `python3 frame_sources.py` to benchmark encoding and the pipeline offline at every valid resolution.
+
+import os
+import time
+
+import cv2
+import numpy as np
+
+VALID_SIZES = [
+    (1920, 1080), (1280, 720), (960, 540),
+    (848, 480), (640, 480), (640, 360),
+    (424, 240), (320, 240), (320, 180)
+]
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+
+def valid_fps(size):
+    return [6, 15, 30] if size in [(1920, 1080), (1280, 720)] else [6, 15, 30, 60]
+
+
+def validate_config(width, height, fps):
+    size = (width, height)
+
+    if size not in VALID_SIZES:
+        raise ValueError(f"Unsupported image resolution {size}. Valid options are: {VALID_SIZES}")
+
+    if fps not in valid_fps(size):
+        raise ValueError(f"Unsupported FPS {fps} for resolution {size}. Valid FPS options are: {valid_fps(size)}")
+
+
+class Pacer:
+    """Sleep until the next frame deadline, without drift over time. fps=0 runs as fast as possible."""
+
+    def __init__(self, fps, clock=time.monotonic, sleep=time.sleep):
+        self.period = 1.0 / fps if fps else 0.0
+        self.clock = clock
+        self.sleep = sleep
+        self.deadline = None
+
+    def wait(self):
+        if not self.period:
+            return
+        now = self.clock()
+        if self.deadline is None or now - self.deadline > self.period: # first frame or fell behind, restart
+            self.deadline = now
+        elif self.deadline > now:
+            self.sleep(self.deadline - now)
+        self.deadline += self.period
+
+
+class FrameSource:
+    """read() blocks until the next BGR frame of shape (height, width, 3) and returns it, or None.
+
+    The returned image is only valid until the next read() or release().
+    Sources with depth also set `depth` to the uint16 depth image of the frame,
+    aligned to color and of shape (height, width), otherwise it is None.
+    Hardware sources set `timestamp` to the capture time of the frame on the
+    device clock in ms, see include/clock_sync.py; it is None for the others.
+    """
+
+    def __init__(self, width, height, fps):
+        self.width, self.height, self.fps = width, height, fps
+        self.depth = None
+        self.timestamp = None
+
+    @property
+    def shape(self):
+        return (self.height, self.width, 3)
+
+    def read(self):
+        raise NotImplementedError
+
+    def release(self):
+        # the last image is no longer needed
+        pass
+
+    def stop(self):
+        pass
+
+
+class RealSenseSource(FrameSource):
+    """Color frames of the RealSense camera, with depth=True also z16 depth aligned to color.
+
+    Depth is streamed at depth_size (a native depth resolution) and the same fps,
+    librealsense reprojects it onto the color image, so both share one timestamp.
+    """
+
+    def __init__(self, width, height, fps, depth=False, depth_size=(848, 480)):
+        super().__init__(width, height, fps)
+        import pyrealsense2 as rs
+
+        self.pipeline = rs.pipeline()
+        config = rs.config()
+        config.enable_stream(rs.stream.color, width, height, rs.format.bgr8, fps)
+        if depth:
+            config.enable_stream(rs.stream.depth, depth_size[0], depth_size[1], rs.format.z16, fps)
+        self.pipeline.start(config)
+        self.align = rs.align(rs.stream.color) if depth else None
+        self.frame = None
+
+    def read(self):
+        frames = self.pipeline.wait_for_frames()
+        if self.align is not None:
+            frames = self.align.process(frames)
+            depth_frame = frames.get_depth_frame()
+            self.depth = np.asanyarray(depth_frame.get_data()) if depth_frame else None
+        color_frame = frames.get_color_frame()
+        if not color_frame:
+            return None
+        self.frame = frames # owns the image memory, views without copy are returned
+        self.timestamp = color_frame.get_timestamp()
+        return np.asanyarray(color_frame.get_data())
+
+    def release(self):
+        # hand the frames back to librealsense
+        self.frame = None
+        self.depth = None
+
+    def stop(self):
+        self.release()
+        self.pipeline.stop()
+
+
+class FileSource(FrameSource):
+    """Frames of a video file or of the images in a directory (sorted by name), looped and paced to fps."""
+
+    def __init__(self, path, width, height, fps, loop=True, realtime=True):
+        super().__init__(width, height, fps)
+        self.path = os.path.expanduser(path)
+        self.loop = loop
+        self.pacer = Pacer(fps if realtime else 0)
+        self.buf = np.empty(self.shape, np.uint8)
+
+        if os.path.isdir(self.path):
+            self.files = sorted(os.path.join(self.path, f) for f in os.listdir(self.path)
+                                if f.lower().endswith(IMAGE_EXTENSIONS))
+            if not self.files:
+                raise ValueError(f"No images in {self.path}")
+            self.idx = 0
+            self.capture = None
+        else:
+            self.capture = cv2.VideoCapture(self.path)
+            if not self.capture.isOpened():
+                raise ValueError(f"Cannot open video {self.path}")
+
+    def _next_image(self):
+        if self.capture is None:
+            if self.idx >= len(self.files):
+                if not self.loop:
+                    return None
+                self.idx = 0
+            image = cv2.imread(self.files[self.idx], cv2.IMREAD_COLOR)
+            self.idx += 1
+            return image
+
+        ok, image = self.capture.read()
+        if not ok and self.loop:
+            self.capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ok, image = self.capture.read()
+        return image if ok else None
+
+    def read(self):
+        self.pacer.wait()
+        image = self._next_image()
+        if image is None:
+            return None
+        if image.shape != self.shape:
+            cv2.resize(image, (self.width, self.height), dst=self.buf, interpolation=cv2.INTER_AREA)
+            return self.buf
+        return image
+
+    def stop(self):
+        if self.capture is not None:
+            self.capture.release()
+
+
+class SyntheticSource(FrameSource):
+    """Smooth gradient background with a moving box and frame counter, roughly as compressible as a camera image.
+
+    With depth=True a tilted floor plane in mm with the box in front of it and
+    invalid (0) pixels at the left border, like the depth shadow of a stereo camera.
+    """
+
+    def __init__(self, width, height, fps, realtime=True, seed=0, depth=False):
+        super().__init__(width, height, fps)
+        self.pacer = Pacer(fps if realtime else 0)
+        y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+        noise = np.random.RandomState(seed).randint(0, 8, size=self.shape).astype(np.float32) # sensor noise
+        background = np.stack([255 * x / width, 255 * y / height, 128 + 64 * np.sin(x / 40.0) * np.cos(y / 30.0)], axis=2)
+        self.background = np.clip(background + noise, 0, 255).astype(np.uint8)
+        self.buf = np.empty(self.shape, np.uint8)
+        self.count = 0
+
+        self.depth_background = None
+        if depth:
+            floor = 6000 - 4000 * y / height + np.random.RandomState(seed).randint(0, 16, size=(height, width))
+            floor[:, :width // 20] = 0
+            self.depth_background = floor.astype(np.uint16)
+            self.depth_buf = np.empty((height, width), np.uint16)
+
+    def read(self):
+        self.pacer.wait()
+        np.copyto(self.buf, self.background)
+        size = max(self.height // 4, 8)
+        x0 = (self.count * 4) % max(self.width - size, 1)
+        y0 = (self.height - size) // 2
+        cv2.rectangle(self.buf, (x0, y0), (x0 + size, y0 + size), (0, 0, 255), -1)
+        if self.depth_background is not None:
+            np.copyto(self.depth_buf, self.depth_background)
+            self.depth_buf[y0:y0 + size, x0:x0 + size] = 1500
+            self.depth = self.depth_buf
+        cv2.putText(self.buf, str(self.count), (10, self.height - 10), cv2.FONT_HERSHEY_SIMPLEX, 1.0, (255, 255, 255), 2)
+        self.count += 1
+        return self.buf
+
+
+def make_source(kind, width, height, fps, path='', depth=False, depth_size=(848, 480)):
+    # kind: 'realsense', 'file' (video file or image directory at path, no depth) or 'synthetic'
+    if kind == 'realsense':
+        return RealSenseSource(width, height, fps, depth, depth_size)
+    if kind == 'file':
+        return FileSource(path, width, height, fps)
+    if kind == 'synthetic':
+        return SyntheticSource(width, height, fps, depth=depth)
+    raise ValueError(f"Unknown frame source {kind}. Valid options are: realsense, file, synthetic")
+
+
+if __name__ == '__main__':
+    import argparse
+
+    from frame_buffers import BufferPool
+    from jpeg_pipeline import JpegPipeline, encode_jpeg
+    from pipeline_stats import StageStats
+
+    parser = argparse.ArgumentParser(description="Offline benchmark of the JPEG publisher path")
+    parser.add_argument('--frames', type=int, default=120)
+    parser.add_argument('--quality', type=int, default=95)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--source', default='synthetic', help="synthetic or a video file / image directory")
+    args = parser.parse_args()
+
+    def open_source(width, height, fps, realtime):
+        if args.source == 'synthetic':
+            return SyntheticSource(width, height, fps, realtime=realtime)
+        return FileSource(args.source, width, height, fps, realtime=realtime)
+
+    # seq fps: unpaced sequential throughput, pipe fps / latency: pipelined at the highest camera fps of the size
+    print("{:>10} {:>10} {:>10} {:>10} {:>10} {:>14} {:>12}".format(
+        'size', 'enc p50', 'enc p95', 'kB/frame', 'seq fps', 'pipe fps', 'latency p50'))
+
+    for width, height in VALID_SIZES:
+        source = open_source(width, height, 0, False)
+
+        # sequential: read, encode, serialize one after another
+        encode_time = StageStats('encode', window=args.frames)
+        nbytes = 0
+        t0 = time.perf_counter()
+        for _ in range(args.frames):
+            image = source.read()
+            t1 = time.perf_counter()
+            payload = encode_jpeg(image, args.quality).tobytes()
+            encode_time.record(time.perf_counter() - t1)
+            nbytes += len(payload)
+        seq_fps = args.frames / (time.perf_counter() - t0)
+        source.stop()
+
+        # pipelined: capture thread and encoder pool, counts only published frames
+        fps = max(valid_fps((width, height)))
+        source = open_source(width, height, fps, True)
+        buffers = BufferPool(source.shape, args.workers + 1)
+        published = []
+
+        def grab():
+            buf = buffers.copy_in(source.read())
+            return (buf, None, lambda: buffers.release(buf)) if buf is not None else None
+
+        pipe = JpegPipeline(grab, lambda encoded, stamp: published.append(len(encoded)), workers=args.workers,
+                            encode=lambda image: encode_jpeg(image, args.quality))
+        t0 = time.perf_counter()
+        pipe.start()
+        while len(published) < args.frames:
+            time.sleep(0.001)
+        pipe.stop()
+        pipe_fps = len(published) / (time.perf_counter() - t0)
+        source.stop()
+
+        summary = encode_time.summary()
+        print("{:>10} {:>8.2f}ms {:>8.2f}ms {:>10.1f} {:>10.1f} {:>8.1f} / {:<3} {:>10.2f}ms".format(
+            f"{width}x{height}", summary['p50_ms'], summary['p95_ms'], nbytes / args.frames / 1e3, seq_fps,
+            pipe_fps, fps, pipe.latency.summary()['p50_ms']))
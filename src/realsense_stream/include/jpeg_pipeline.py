@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+
+from pipeline_stats import StageStats, RateMeter
+
+
+def encode_jpeg(image, quality=95, scale=1.0):
+    if scale != 1.0:
+        image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    ok, encoded = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ok:
+        raise RuntimeError("JPEG encoding failed")
+    return encoded
+
+
+# compressed_depth_image_transport message: ConfigHeader (format PNG = 1, two unused quantization floats) + PNG
+DEPTH_FORMAT = "16UC1; compressedDepth png"
+DEPTH_HEADER = struct.pack('<iff', 1, 0.0, 0.0)
+
+
+def encode_depth_png(depth, level=1):
+    # lossless 16 bit PNG, low levels trade a few percent of size for a multiple of the speed
+    ok, encoded = cv2.imencode('.png', depth, [cv2.IMWRITE_PNG_COMPRESSION, level])
+    if not ok:
+        raise RuntimeError("PNG encoding failed")
+    return DEPTH_HEADER + encoded.tobytes()
+
+
+class JpegPipeline:
+    """Capture thread -> bounded pool of JPEG encoders -> in-order publish.
+
+    grab() blocks until the next frame and returns (image, stamp, release) or
+    None, `release` (or None) is called once the image is no longer needed, e.g.
+    to return a BufferPool buffer. publish(encoded, stamp) is called from the
+    encoder threads, cv2.imencode releases the GIL so the workers encode in parallel.
+    `image` is passed to encode() as is, e.g. a (color, depth) pair.
+
+    Frames are never queued: if all encoders are busy the new frame is dropped,
+    and a frame that finishes after a newer one was published is dropped as
+    stale, so the output is always in order and as recent as possible.
+
+    With measure_latency=False the caller records the capture-to-publish
+    latency itself (e.g. in publish(), from the frame stamp) and report()
+    leaves it out, so no frame is counted twice.
+    """
+
+    def __init__(self, grab, publish, workers=2, encode=encode_jpeg, measure_latency=True, clock=time.monotonic):
+        self.grab = grab
+        self.publish = publish
+        self.encode = encode
+        self.clock = clock
+        self.workers = workers
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.free = threading.Semaphore(workers) # encoders without a frame
+        self.lock = threading.Lock() # orders publishing, guards the stats of the encoder threads
+        self.running = False
+        self.thread = None
+
+        self.seq = 0
+        self.last_published = 0
+        self.counters = {'captured': 0, 'published': 0, 'dropped_busy': 0, 'dropped_stale': 0, 'errors': 0}
+        self.encode_time = StageStats('encode')
+        self.latency = StageStats('capture_to_publish') if measure_latency else None
+        self.fps = RateMeter(clock)
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._capture_loop, name='jpeg_capture', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join(timeout=2.0)
+        self.pool.shutdown(wait=True)
+
+    def _capture_loop(self):
+        while self.running:
+            frame = self.grab()
+            if frame is None:
+                continue
+            t_capture = self.clock()
+            busy = not self.free.acquire(blocking=False)
+            with self.lock:
+                self.counters['captured'] += 1
+                if busy:
+                    self.counters['dropped_busy'] += 1 # latest wins, never queue behind busy encoders
+
+            if busy:
+                if frame[2] is not None:
+                    frame[2]()
+                continue
+
+            self.seq += 1
+            self.pool.submit(self._encode, self.seq, frame, t_capture)
+
+    def _encode(self, seq, frame, t_capture):
+        image, stamp, release = frame
+        try:
+            t0 = self.clock()
+            try:
+                encoded = self.encode(image)
+            finally:
+                if release is not None:
+                    release()
+            encode_time = self.clock() - t0
+
+            # held through publish(), so a frame that passed the check is published before any newer one
+            with self.lock:
+                self.encode_time.record(encode_time)
+                if seq < self.last_published:
+                    self.counters['dropped_stale'] += 1
+                    return
+                self.last_published = seq
+
+                self.publish(encoded, stamp)
+                if self.latency is not None:
+                    self.latency.record(self.clock() - t_capture)
+                self.counters['published'] += 1
+                self.fps.tick()
+        except Exception:
+            with self.lock:
+                self.counters['errors'] += 1
+            raise
+        finally:
+            self.free.release()
+
+    def report(self):
+        # one line summary since the last report
+        with self.lock:
+            stats = [self.encode_time] if self.latency is None else [self.encode_time, self.latency]
+            return "fps={:.1f} {} | {}".format(
+                self.fps.rate(), " | ".join(str(s) for s in stats),
+                " ".join("{}={}".format(k, v) for k, v in self.counters.items()))
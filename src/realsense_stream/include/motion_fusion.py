@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+
+# Fusion of the separate accel and gyro streams of the RealSense motion module into imu samples.
+# Run `python3 motion_fusion.py` for a simulation with 200 Hz accel, 400 Hz gyro and lost samples.
+
+import threading
+from collections import deque
+
+
+class MotionFusion:
+    """Accel interpolated onto the gyro timestamps, one fused sample per gyro sample.
+
+    push() is called from the librealsense callback thread, fused() from the
+    publishing thread. Both hold a lock while they touch the deques and
+    counters, fused() only for one sample at a time and not while the caller
+    publishes it. Frame number gaps count samples lost before they reached the
+    callback. A gyro sample is held
+    back until the next accel sample arrives, gyro samples older than the first
+    accel sample are dropped as unmatched. Both deques hold at most maxlen
+    samples, if fused() falls behind (or the accel stream stops) the oldest
+    samples are evicted and counted as overflow.
+    """
+
+    def __init__(self, maxlen=1000):
+        self.accel = deque(maxlen=maxlen) # (stamp, (x, y, z))
+        self.gyro = deque(maxlen=maxlen)
+        self.last_frame = {'accel': None, 'gyro': None}
+        self.counters = {'accel': 0, 'gyro': 0, 'accel_lost': 0, 'gyro_lost': 0, 'accel_overflow': 0, 'gyro_overflow': 0,
+                         'fused': 0, 'unmatched': 0}
+        self.lock = threading.Lock()
+
+    def push(self, kind, frame_number, stamp, xyz):
+        # kind: 'accel' or 'gyro', stamp in seconds, xyz: tuple of the motion data
+        with self.lock:
+            last = self.last_frame[kind]
+            if last is not None and frame_number > last + 1:
+                self.counters[kind + '_lost'] += frame_number - last - 1
+            self.last_frame[kind] = frame_number
+            self.counters[kind] += 1
+            samples = self.accel if kind == 'accel' else self.gyro
+            if len(samples) == samples.maxlen:
+                self.counters[kind + '_overflow'] += 1 # the append evicts the oldest sample
+            samples.append((stamp, xyz))
+
+    def _next(self):
+        # the next fused sample or None, called with the lock held
+        accel, gyro = self.accel, self.gyro
+        while gyro:
+            t, angular = gyro[0]
+            while len(accel) > 1 and accel[1][0] <= t:
+                accel.popleft() # keep the newest accel sample at or before t
+            if not accel or t < accel[0][0]:
+                gyro.popleft()
+                self.counters['unmatched'] += 1
+                continue
+            if len(accel) < 2:
+                return None # wait for the next accel sample
+
+            (t0, a0), (t1, a1) = accel[0], accel[1]
+            w = (t - t0) / (t1 - t0) if t1 > t0 else 0.0
+            gyro.popleft()
+            self.counters['fused'] += 1
+            return t, (a0[0] + w * (a1[0] - a0[0]), a0[1] + w * (a1[1] - a0[1]), a0[2] + w * (a1[2] - a0[2])), angular
+        return None
+
+    def fused(self):
+        # yields (stamp, accel, gyro) for every gyro sample that can be interpolated now, in order
+        while True:
+            with self.lock:
+                sample = self._next()
+            if sample is None:
+                return
+            yield sample
+
+
+if __name__ == '__main__':
+    import math
+    import random
+    import threading
+    import time
+
+    random.seed(0)
+    fusion = MotionFusion()
+    duration, lost = 2.0, {300, 301, 555}
+
+    def producer():
+        # 400 Hz gyro, 200 Hz accel with a sine on x, delivered in bursts like the USB transfers
+        events = sorted([(i / 400.0, 'gyro', i) for i in range(int(400 * duration))] +
+                        [(i / 200.0 + 0.0007, 'accel', i) for i in range(int(200 * duration))])
+        for t, kind, n in events:
+            if kind == 'gyro' and n in lost:
+                continue
+            fusion.push(kind, n, t, (math.sin(2 * math.pi * t), 0.0, 9.81) if kind == 'accel' else (0.0, 0.0, n))
+            if random.random() < 0.05:
+                time.sleep(0.001)
+
+    thread = threading.Thread(target=producer)
+    thread.start()
+    samples, error = 0, 0.0
+    while thread.is_alive() or fusion.gyro:
+        for t, accel, gyro in fusion.fused():
+            samples += 1
+            error = max(error, abs(accel[0] - math.sin(2 * math.pi * t)))
+        if not thread.is_alive() and len(fusion.accel) < 2:
+            break
+        time.sleep(0.002)
+    thread.join()
+    print("fused {} samples, max interpolation error {:.4f}, counters {}".format(samples, error, fusion.counters))
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+
+import time
+from collections import deque
+
+import numpy as np
+
+
+class StageStats:
+    """Rolling window of the durations (seconds) of one pipeline stage, summarized in ms.
+
+    Other quantities use `scale` and `unit`, e.g. StageStats('payload', scale=1e-3, unit='kB').
+    """
+
+    def __init__(self, name, window=300, scale=1e3, unit='ms'):
+        self.name = name
+        self.samples = deque(maxlen=window)
+        self.count = 0
+        self.scale = scale
+        self.unit = unit
+
+    def record(self, value):
+        self.samples.append(value)
+        self.count += 1
+
+    def summary(self):
+        keys = ('mean', 'p50', 'p95', 'p99', 'max')
+        if not self.samples:
+            values = (0.0,) * len(keys)
+        else:
+            scaled = self.scale * np.asarray(self.samples)
+            values = (scaled.mean(),) + tuple(np.percentile(scaled, (50, 95, 99))) + (scaled.max(),)
+        summary = {'count': self.count}
+        summary.update(('{}_{}'.format(k, self.unit), float(v)) for k, v in zip(keys, values))
+        return summary
+
+    def __str__(self):
+        summary = self.summary()
+        return "{}: ".format(self.name) + " ".join(
+            "{}={:.2f}{}".format(k, summary['{}_{}'.format(k, self.unit)], self.unit) for k in ('mean', 'p50', 'p95', 'p99', 'max'))
+
+
+class RateMeter:
+    """Events per second since the last reset, e.g. the achieved fps."""
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.reset()
+
+    def reset(self):
+        self.start = self.clock()
+        self.events = 0
+
+    def tick(self, n=1):
+        self.events += n
+
+    def rate(self, reset=True):
+        elapsed = self.clock() - self.start
+        rate = self.events / elapsed if elapsed > 0 else 0.0
+        if reset:
+            self.reset()
+        return rate
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+
+import math
+import threading
+import time
+from collections import deque
+
+
+class AdaptiveQuality:
+    """Closed loop JPEG quality and downscale control for a byte rate budget.
+
+    update() is called with the size of every published frame. Every
+    `interval` seconds the byte rate of the last `window` seconds is compared to
+    the budget and the quality moves by a step proportional to the log of the
+    ratio. Below `min_quality` the next smaller scale of `scales` is used
+    instead, with the quality raised only by what the smaller area saves. The
+    image is scaled up again as soon as the quality predicted for the larger
+    area (lowered by the same rule) is at least `min_quality`.
+    """
+
+    def __init__(self, budget, quality=80, min_quality=30, max_quality=95, scales=(1.0,),
+                 max_step=10, deadband=0.1, interval=0.5, window=1.0, clock=time.monotonic):
+        self.budget = float(budget) # bytes per second
+        self.quality = quality
+        self.min_quality = min_quality
+        self.max_quality = max_quality
+        self.scales = sorted(scales, reverse=True)
+        self.scale_idx = 0
+        self.max_step = max_step
+        self.deadband = deadband # relative error without a correction
+        self.interval = interval
+        self.window = window
+        self.clock = clock
+
+        self.lock = threading.Lock()
+        self.sizes = deque() # (time, bytes) of the frames in the window
+        self.window_bytes = 0
+        self.next_update = clock() + interval
+        self.byte_rate = 0.0
+
+    @property
+    def scale(self):
+        return self.scales[self.scale_idx]
+
+    def settings(self):
+        # (quality, scale) for the next frame
+        return self.quality, self.scales[self.scale_idx]
+
+    def update(self, nbytes):
+        now = self.clock()
+        with self.lock:
+            self.sizes.append((now, nbytes))
+            self.window_bytes += nbytes
+            while self.sizes and self.sizes[0][0] < now - self.window:
+                self.window_bytes -= self.sizes.popleft()[1]
+
+            if now < self.next_update:
+                return False
+            self.next_update = now + self.interval
+            self.byte_rate = self.window_bytes / self.window
+            self._adjust()
+            return True
+
+    def _adjust(self):
+        if self.byte_rate <= 0:
+            return
+        ratio = self.budget / self.byte_rate
+        if abs(ratio - 1.0) < self.deadband:
+            return
+
+        # about 10 quality steps per factor 2 in size, clamped to max_step
+        step = int(round(10 * math.log2(ratio)))
+        step = max(-self.max_step, min(self.max_step, step))
+        quality = self.quality + step
+
+        if quality < self.min_quality and self.scale_idx < len(self.scales) - 1:
+            # smaller image instead of a quality below the floor, the quality only gains what the smaller area saves
+            area = (self.scales[self.scale_idx + 1] / self.scale) ** 2
+            self.scale_idx += 1
+            quality = int(round(quality - 10 * math.log2(area)))
+        elif self.scale_idx > 0:
+            # the larger image if the budget allows it at min_quality or better, the quality pays for the larger area
+            area = (self.scales[self.scale_idx - 1] / self.scale) ** 2
+            predicted = int(round(quality - 10 * math.log2(area)))
+            if predicted >= self.min_quality:
+                self.scale_idx -= 1
+                quality = predicted
+
+        self.quality = max(self.min_quality, min(self.max_quality, quality))
+
+
+if __name__ == '__main__':
+    import sys
+
+    # simulated stream: frame size grows with quality and the square of the scale
+    now = [0.0]
+    ctrl = AdaptiveQuality(budget=float(sys.argv[1]) if len(sys.argv) > 1 else 2e6, quality=90, scales=(1.0, 0.75, 0.5), clock=lambda: now[0])
+    for i in range(30 * 20):
+        now[0] = i / 30.0
+        quality, scale = ctrl.settings()
+        size = 300e3 * scale ** 2 * 2 ** ((quality - 80) / 10.0)
+        if ctrl.update(size) and (i % 30 == 0 or len(sys.argv) > 1):
+            print("t={:4.1f}s quality={} scale={} byte_rate={:.2f} MB/s".format(now[0], quality, scale, ctrl.byte_rate / 1e6))
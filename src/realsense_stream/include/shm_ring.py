@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+
+# Shared memory ring buffer for frames between processes on the same host (/dev/shm).
+# Run `python3 shm_ring.py` for a write/read round trip benchmark at 1080p.
+
+import mmap
+import os
+import struct
+
+import numpy as np
+
+MAGIC = b'MXCKRING'
+VERSION = 1
+
+# magic, version, slots, slot size, reserved, latest seq
+HEADER = struct.Struct('<8sIIIIQ')
+HEADER_SIZE = 64
+LATEST_OFFSET = 24
+# lock, seq, stamp secs, stamp nsecs, width, height, nbytes, encoding
+SLOT_HEADER = struct.Struct('<QQIIIII12s')
+SLOT_HEADER_SIZE = 64
+
+
+def shm_path(name):
+    return os.path.join('/dev/shm', name)
+
+
+class ShmRingWriter:
+    """Single writer of a ring of `slots` frames of up to `slot_size` bytes in /dev/shm/<name>.
+
+    Every slot carries a seqlock counter, odd while the slot is written, so a
+    reader that copies a slot while it is overwritten notices and retries.
+    The ring header holds the seq of the newest complete frame.
+    """
+
+    def __init__(self, name, slot_size, slots=4):
+        self.name = name
+        self.slots = slots
+        self.slot_size = slot_size
+        self.stride = SLOT_HEADER_SIZE + slot_size
+        self.seq = 0
+
+        size = HEADER_SIZE + slots * self.stride
+        # a new file (new inode) on every start, readers of a previous writer notice it with stale()
+        try:
+            os.unlink(shm_path(name))
+        except FileNotFoundError:
+            pass
+        fd = os.open(shm_path(name), os.O_CREAT | os.O_EXCL | os.O_RDWR, 0o644)
+        try:
+            self.inode = os.fstat(fd).st_ino
+            os.ftruncate(fd, size)
+            self.mm = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        HEADER.pack_into(self.mm, 0, MAGIC, VERSION, slots, slot_size, 0, 0)
+
+    def write(self, data, stamp, width=0, height=0, encoding=''):
+        # data: bytes or contiguous numpy array, stamp: (secs, nsecs); returns the seq of the frame
+        buf = memoryview(data).cast('B')
+        nbytes = buf.nbytes
+        if nbytes > self.slot_size:
+            raise ValueError(f"Frame of {nbytes} bytes does not fit into slots of {self.slot_size} bytes")
+
+        self.seq += 1
+        off = HEADER_SIZE + (self.seq % self.slots) * self.stride
+        lock = struct.unpack_from('<Q', self.mm, off)[0]
+
+        struct.pack_into('<Q', self.mm, off, lock + 1) # odd: being written
+        self.mm[off + SLOT_HEADER_SIZE:off + SLOT_HEADER_SIZE + nbytes] = buf
+        SLOT_HEADER.pack_into(self.mm, off, lock + 1, self.seq, stamp[0], stamp[1], width, height, nbytes,
+                              encoding.encode())
+        struct.pack_into('<Q', self.mm, off, lock + 2) # even: complete
+        struct.pack_into('<Q', self.mm, LATEST_OFFSET, self.seq)
+        return self.seq
+
+    def close(self):
+        self.mm.close()
+        try:
+            if os.stat(shm_path(self.name)).st_ino == self.inode: # not the ring of a newer writer
+                os.unlink(shm_path(self.name))
+        except FileNotFoundError:
+            pass
+
+
+class ShmRingReader:
+    """Reader of a ShmRingWriter ring, copies frames straight from shared memory into a caller buffer."""
+
+    def __init__(self, name):
+        self.name = name
+        with open(shm_path(name), 'r+b') as f:
+            self.inode = os.fstat(f.fileno()).st_ino
+            self.mm = mmap.mmap(f.fileno(), 0)
+        magic, version, self.slots, self.slot_size, _, _ = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{shm_path(name)} is not a frame ring (version {VERSION})")
+        self.stride = SLOT_HEADER_SIZE + self.slot_size
+        self.data = np.frombuffer(self.mm, np.uint8)
+
+    def stale(self):
+        # True if the writer restarted (or stopped) and the mapped ring is no longer the one in /dev/shm
+        try:
+            return os.stat(shm_path(self.name)).st_ino != self.inode
+        except FileNotFoundError:
+            return True
+
+    @property
+    def latest(self):
+        return struct.unpack_from('<Q', self.mm, LATEST_OFFSET)[0]
+
+    def find(self, stamp):
+        # seq of the frame with header stamp (secs, nsecs) still in the ring, None if it was overwritten
+        for slot in range(self.slots):
+            _, seq, secs, nsecs = struct.unpack_from('<QQII', self.mm, HEADER_SIZE + slot * self.stride)
+            if (secs, nsecs) == tuple(stamp) and seq:
+                return seq
+        return None
+
+    def read(self, seq=None, out=None, retries=3):
+        """Copy frame `seq` (default the newest) into `out` (uint8 array, allocated if None).
+
+        Returns (meta, data) with data a view of `out` of the frame size, or None
+        if the frame does not exist or was overwritten while copying.
+        """
+        if seq is None:
+            seq = self.latest
+        if seq == 0:
+            return None
+        off = HEADER_SIZE + (seq % self.slots) * self.stride
+
+        for _ in range(retries):
+            lock, slot_seq, secs, nsecs, width, height, nbytes, encoding = SLOT_HEADER.unpack_from(self.mm, off)
+            if lock % 2:
+                continue # being written
+            if slot_seq != seq:
+                return None # overwritten by a newer frame
+
+            if out is None or out.size < nbytes:
+                out = np.empty(nbytes, np.uint8)
+            flat = out.reshape(-1)
+            np.copyto(flat[:nbytes], self.data[off + SLOT_HEADER_SIZE:off + SLOT_HEADER_SIZE + nbytes])
+
+            if struct.unpack_from('<Q', self.mm, off)[0] == lock:
+                meta = {'seq': seq, 'stamp': (secs, nsecs), 'width': width, 'height': height,
+                        'encoding': encoding.rstrip(b'\0').decode()}
+                return meta, flat[:nbytes]
+        return None
+
+    def close(self):
+        self.data = None
+        self.mm.close()
+
+
+if __name__ == '__main__':
+    import time
+
+    shape = (1080, 1920, 3)
+    frame = np.random.RandomState(0).randint(0, 255, size=shape, dtype=np.uint8)
+    out = np.empty(shape, np.uint8)
+
+    writer = ShmRingWriter('mxck_ring_benchmark', frame.nbytes, slots=4)
+    reader = ShmRingReader('mxck_ring_benchmark')
+    try:
+        n = 200
+        t0 = time.perf_counter()
+        for i in range(n):
+            writer.write(frame, (i, 0), shape[1], shape[0], 'bgr8')
+            meta, data = reader.read(out=out)
+        elapsed = time.perf_counter() - t0
+        assert np.array_equal(out, frame) and meta['seq'] == n
+        print("raw 1080p write + read: {:.2f} ms/frame ({:.0f} MB/s)".format(1e3 * elapsed / n, 2 * n * frame.nbytes / elapsed / 1e6))
+    finally:
+        reader.close()
+        writer.close()
@@ -2,7 +2,21 @@
 
 import rospy
 from sensor_msgs.msg import Imu
+from std_msgs.msg import Float32, Float64MultiArray
 import pyrealsense2 as rs
+import sys
+import os
+import rospkg
+import threading
+
+# add the include path of the package so that interpeter can find the modules
+sys.path.append(os.path.join(rospkg.RosPack().get_path('realsense_stream'), 'include'))
+sys.path.append(os.path.join(rospkg.RosPack().get_path('imu_control'), 'include'))
+
+from clock_sync import ClockSync
+from motion_fusion import MotionFusion
+from pipeline_stats import StageStats, RateMeter
+from imu_batch import ImuBatcher
 
 class RealSenseIMUPublisher:
     def __init__(self):
@@ -13,6 +27,12 @@ class RealSenseIMUPublisher:
         # Fetch rates from ROS parameters, with default values if not set
         accel_fps = rospy.get_param('~accel_fps', 200)  
         gyro_fps = rospy.get_param('~gyro_fps', 200)
+        # stamp with the capture time of the motion samples (device clock mapped to ROS time) instead of the arrival time
+        self.hardware_stamps = rospy.get_param('~hardware_stamps', True)
+        # callback: every accel and gyro sample is delivered by the librealsense callback and one message per gyro sample
+        # is published (accel interpolated), otherwise framesets are polled at min(accel_fps, gyro_fps)
+        self.callback_mode = rospy.get_param('~callback', False)
+        self.stats_interval = rospy.get_param('~stats_interval', 10.0)
 
         # Validate accel_fps and gyro_fps
         valid_accel_fps = [100, 200]
@@ -34,25 +54,89 @@ class RealSenseIMUPublisher:
         self.config.enable_stream(rs.stream.accel, rs.format.motion_xyz32f, accel_fps)
         self.config.enable_stream(rs.stream.gyro, rs.format.motion_xyz32f, gyro_fps)
 
-        # Start the pipeline
-        self.pipeline.start(self.config)
+        # Create a publisher for the IMU data, every sample is kept in callback mode
+        self.imu_publisher = rospy.Publisher('/rs_imu', Imu, queue_size=gyro_fps if self.callback_mode else 1)
+        # capture-to-publish latency in ms
+        self.latency_publisher = rospy.Publisher('/rs_imu/capture_latency', Float32, queue_size=1)
+        self.clock = ClockSync()
 
-        # Create a publisher for the IMU data
-        self.imu_publisher = rospy.Publisher('/rs_imu', Imu, queue_size=1)
+        # batch_size: also publish batches of this many samples on /rs_imu/batch (Float64MultiArray, see imu_control/include/imu_batch.py), 0 = off
+        batch_size = rospy.get_param('~batch_size', 0)
+        self.batch = None
+        if batch_size > 0:
+            self.batch = ImuBatcher(batch_size, rospy.Publisher('/rs_imu/batch', Float64MultiArray, queue_size=10).publish)
+            rospy.on_shutdown(self.batch.flush) # publish the partial last batch
 
-        # Set the desired publishing rate as the minimum of accel_fps and gyro_fps
-        hz = min(accel_fps, gyro_fps)
-        self.rate = rospy.Rate(hz)
+        # Start the pipeline
+        if self.callback_mode:
+            self.fusion = MotionFusion()
+            self.ready = threading.Event() # set by the callback when a gyro sample arrived
+            self.latency = StageStats('end_to_end')
+            self.fps = RateMeter()
+            self.pipeline.start(self.config, self.motion_callback)
+        else:
+            self.pipeline.start(self.config)
+
+            # Set the desired publishing rate as the minimum of accel_fps and gyro_fps
+            hz = min(accel_fps, gyro_fps)
+            self.rate = rospy.Rate(hz)
 
         # Create an IMU message
         self.imu_msg = Imu()
 
-              
+
+    def motion_callback(self, frame):
+        # librealsense thread: stamp the samples and queue them, publishing happens in publish_fused()
+        arrival = rospy.get_time()
+        frames = frame.as_frameset() if frame.is_frameset() else [frame]
+        for f in frames:
+            motion = f.as_motion_frame()
+            if not motion:
+                continue
+            kind = 'gyro' if motion.get_profile().stream_type() == rs.stream.gyro else 'accel'
+            stamp = self.clock.update(motion.get_timestamp(), arrival) if self.hardware_stamps else arrival
+            data = motion.get_motion_data()
+            self.fusion.push(kind, motion.get_frame_number(), stamp, (data.x, data.y, data.z))
+            if kind == 'gyro':
+                self.ready.set()
+
+    def publish_fused(self):
+        if self.stats_interval > 0:
+            rospy.Timer(rospy.Duration(self.stats_interval), lambda e: rospy.loginfo(
+                "fps={:.1f} {} | {}".format(self.fps.rate(), self.latency,
+                                            " ".join(f"{k}={v}" for k, v in self.fusion.counters.items()))))
+        try:
+            while not rospy.is_shutdown():
+                if not self.ready.wait(0.5):
+                    continue
+                self.ready.clear()
+
+                stamp = None
+                for stamp, accel, gyro in self.fusion.fused():
+                    self.imu_msg.header.stamp = rospy.Time.from_sec(stamp)
+                    self.imu_msg.linear_acceleration.x, self.imu_msg.linear_acceleration.y, self.imu_msg.linear_acceleration.z = accel
+                    self.imu_msg.angular_velocity.x, self.imu_msg.angular_velocity.y, self.imu_msg.angular_velocity.z = gyro
+                    self.imu_publisher.publish(self.imu_msg)
+                    if self.batch is not None:
+                        self.batch.add(stamp, accel, gyro)
+                    self.latency.record(rospy.get_time() - stamp)
+                    self.fps.tick()
+
+                if stamp is not None: # latency of the newest sample of the burst
+                    self.latency_publisher.publish(Float32(1e3 * (rospy.get_time() - stamp)))
+        finally:
+            self.pipeline.stop()
+            rospy.loginfo(f"Motion samples: {self.fusion.counters}")
+
     def publish_imu_data(self):
+        if self.callback_mode:
+            self.publish_fused()
+            return
         try:
             while not rospy.is_shutdown():
                 # Wait for a coherent pair of frames: IMU and RGB
                 frames = self.pipeline.wait_for_frames()
+                arrival = rospy.get_time()
 
                 # Extract IMU data
                 accel_frame = frames.first_or_default(rs.stream.accel, rs.format.motion_xyz32f)
@@ -62,8 +146,13 @@ class RealSenseIMUPublisher:
                     accel_data = accel_frame.as_motion_frame().get_motion_data()
                     gyro_data = gyro_frame.as_motion_frame().get_motion_data()
 
-                    
-                    self.imu_msg.header.stamp = rospy.Time.now()
+                    # the newer of both samples completes the measurement
+                    if self.hardware_stamps:
+                        device_ms = max(accel_frame.get_timestamp(), gyro_frame.get_timestamp())
+                        stamp = self.clock.update(device_ms, arrival)
+                    else:
+                        stamp = arrival
+                    self.imu_msg.header.stamp = rospy.Time.from_sec(stamp)
 
                     self.imu_msg.linear_acceleration.x = accel_data.x
                     self.imu_msg.linear_acceleration.y = accel_data.y
@@ -74,6 +163,9 @@ class RealSenseIMUPublisher:
                     self.imu_msg.angular_velocity.z = gyro_data.z
 
                     self.imu_publisher.publish(self.imu_msg)
+                    if self.batch is not None:
+                        self.batch.add(stamp, (accel_data.x, accel_data.y, accel_data.z), (gyro_data.x, gyro_data.y, gyro_data.z))
+                    self.latency_publisher.publish(Float32(1e3 * (rospy.get_time() - stamp)))
 
                 # Sleep to maintain the desired publishing rate
                 self.rate.sleep()
@@ -1,27 +1,49 @@
 #!/usr/bin/env python3
 
 import rospy
-import pyrealsense2 as rs
 import numpy as np
 import cv2
-from sensor_msgs.msg import CompressedImage
-from cv_bridge import CvBridge
+import sys
+import os
+import rospkg
+import threading
+from sensor_msgs.msg import CompressedImage, Image
+from std_msgs.msg import Int32, Float32
 
-def validate_config(width, height, fps):
-    valid_sizes = [
-        (1920, 1080), (1280, 720), (960, 540), 
-        (848, 480), (640, 480), (640, 360), 
-        (424, 240), (320, 240), (320, 180)
-    ]
-    size = (width, height)
+# add the include path of the package so that interpeter can find the modules
+sys.path.append(os.path.join(rospkg.RosPack().get_path('realsense_stream'), 'include'))
 
-    if size not in valid_sizes:
-        raise ValueError(f"Unsupported image resolution {size}. Valid options are: {valid_sizes}")
+from jpeg_pipeline import JpegPipeline, encode_jpeg, encode_depth_png, DEPTH_FORMAT
+from rate_control import AdaptiveQuality
+from frame_buffers import BufferPool
+from frame_sources import make_source, validate_config
+from shm_ring import ShmRingWriter
+from clock_sync import ClockSync
+from pipeline_stats import StageStats
 
-    valid_fps = [6, 15, 30]  if size in [(1920, 1080), (1280, 720)] else [6, 15, 30, 60]
+class ShmOutput:
+    # Frames for consumers on the same host: the frame goes into a shared memory ring (include/shm_ring.py),
+    # an empty 0x0 Image message announces it with the header stamp and encoding, so remote tools still see the stream.
+    # The geometry of the frame is in the slot header of the ring.
+    def __init__(self, mode, name, shape, slots):
+        self.mode = mode # raw: BGR frames, jpeg: the encoded frames
+        height, width, channels = shape
+        slot_size = height * width * channels + (0 if mode == 'raw' else 65536) # JPEG of noise can exceed the raw size
+        self.ring = ShmRingWriter(name, slot_size, slots)
+        self.lock = threading.Lock() # the ring has a single writer, the encoder threads take turns
+        self.pub = rospy.Publisher('/camera/color/image_shm', Image, queue_size=1)
+        self.width, self.height = width, height
+        self.msg = Image(encoding='bgr8' if mode == 'raw' else 'jpeg')
+        rospy.loginfo(f"Shared memory transport ({mode}) in /dev/shm/{name}")
 
-    if fps not in valid_fps:
-        raise ValueError(f"Unsupported FPS {fps} for resolution {size}. Valid FPS options are: {valid_fps}")
+    def write(self, data, timestamp):
+        with self.lock:
+            self.ring.write(data, (timestamp.secs, timestamp.nsecs), self.width, self.height, self.msg.encoding)
+            self.msg.header.stamp = timestamp
+            self.pub.publish(self.msg)
+
+    def close(self):
+        self.ring.close()
 
 def main():
     rospy.init_node('realsense_compressed_publisher', anonymous=True)
@@ -30,6 +52,17 @@ def main():
     width = rospy.get_param('~width', 640)
     height = rospy.get_param('~height', 360)
     fps = rospy.get_param('~fps', 30)
+    source_kind = rospy.get_param('~source', 'realsense') # realsense, file or synthetic
+    source_path = rospy.get_param('~source_path', '') # video file or image directory for source file
+    pipelined = rospy.get_param('~pipelined', False)
+    encoder_workers = rospy.get_param('~encoder_workers', 2)
+    stats_interval = rospy.get_param('~stats_interval', 10.0)
+    jpeg_quality = rospy.get_param('~jpeg_quality', 95)
+    byte_budget = rospy.get_param('~byte_budget', 0) # bytes per second, 0 = fixed jpeg_quality
+    shm_mode = rospy.get_param('~shm', '') # shared memory transport: raw, jpeg or '' (off)
+    depth = rospy.get_param('~depth', False) # depth aligned to color, PNG compressed
+    depth_png_level = rospy.get_param('~depth_png_level', 1)
+    hardware_stamps = rospy.get_param('~hardware_stamps', True) # stamp with the camera capture time instead of the arrival time
 
     # Validate configuration
     try:
@@ -39,45 +72,169 @@ def main():
         return
 
     # Log the publishing topic
-    rospy.loginfo("Publishing compressed images from RealSense camera")
+    rospy.loginfo(f"Publishing compressed images from {source_kind} source")
 
-    # RealSense capture setup
-    pipeline = rs.pipeline()
-    config = rs.config()
-    config.enable_stream(rs.stream.color, width, height, rs.format.bgr8, fps)
-    pipeline.start(config)
+    # Frame source, the RealSense camera or a file / synthetic pattern to profile without the camera
+    source = make_source(source_kind, width, height, fps, source_path, depth=depth,
+                         depth_size=(rospy.get_param('~depth_width', 848), rospy.get_param('~depth_height', 480)))
 
-    bridge = CvBridge()
     pub = rospy.Publisher('/camera/color/image_jpeg', CompressedImage, queue_size=1)
+    depth_pub = None
+    if depth:
+        depth_pub = rospy.Publisher('/camera/aligned_depth_to_color/image_raw/compressedDepth', CompressedImage, queue_size=1)
+
+    # Closed loop quality (and downscale) control for a byte rate budget, e.g. for Foxglove over Wi-Fi
+    rate_control = None
+    if byte_budget > 0:
+        rate_control = AdaptiveQuality(byte_budget, quality=jpeg_quality,
+                                       min_quality=rospy.get_param('~min_quality', 30),
+                                       max_quality=jpeg_quality,
+                                       scales=(1.0, 0.75, 0.5) if rospy.get_param('~downscale', False) else (1.0,))
+        quality_pub = rospy.Publisher('/camera/color/jpeg_quality', Int32, queue_size=1)
+        byte_rate_pub = rospy.Publisher('/camera/color/jpeg_byte_rate', Float32, queue_size=1)
+
+    def encode(image):
+        if rate_control is None:
+            return encode_jpeg(image, jpeg_quality)
+        return encode_jpeg(image, *rate_control.settings())
+
+    def encode_frame(frame):
+        # (color, depth) -> (jpeg, compressedDepth payload), None entries are skipped
+        color, depth_image = frame
+        return (encode(color) if color is not None else None,
+                encode_depth_png(depth_image, depth_png_level) if depth_image is not None else None)
+
+    def sent(nbytes):
+        # feed the size of every published frame to the rate control, publish its state after every adjustment
+        if rate_control is not None and rate_control.update(nbytes):
+            quality_pub.publish(Int32(rate_control.quality))
+            byte_rate_pub.publish(Float32(rate_control.byte_rate))
+
+    shm = None
+    if shm_mode:
+        shm = ShmOutput(shm_mode, rospy.get_param('~shm_name', 'realsense_color'), source.shape, rospy.get_param('~shm_slots', 4))
+        rospy.on_shutdown(shm.close)
+
+    def need_jpeg():
+        # with raw shared memory frames, JPEG encoding is only needed for subscribers over TCPROS
+        return shm is None or shm.mode != 'raw' or pub.get_num_connections() > 0
+
+    # capture time of the frame just read: the device timestamp mapped to ROS time, the arrival time without one
+    clock = ClockSync()
+
+    def stamp_frame():
+        arrival = rospy.get_time()
+        if hardware_stamps and source.timestamp is not None:
+            return rospy.Time.from_sec(clock.update(source.timestamp, arrival))
+        return rospy.Time.from_sec(arrival)
+
+    # capture-to-publish latency of every color frame (depth of the same frame is published right after)
+    latency_pub = rospy.Publisher('/camera/color/capture_latency', Float32, queue_size=1)
+    latency = StageStats('capture_to_publish')
+
+    if stats_interval > 0:
+        rospy.Timer(rospy.Duration(stats_interval), lambda e: rospy.loginfo(
+            f"{latency} clock_offset={clock.offset} resets={clock.resets}"))
+
+    # the sequential loop reuses one message per topic, publish() serializes it before returning
+    color_msg = CompressedImage(format="jpeg")
+    reused_depth_msg = CompressedImage(format=DEPTH_FORMAT)
+
+    def publish(encoded, timestamp, msg=color_msg, depth_msg=reused_depth_msg):
+        # color and depth of one frame share the stamp
+        img_encoded, depth_encoded = encoded
+        if img_encoded is not None:
+            if shm is not None and shm.mode == 'jpeg':
+                shm.write(img_encoded, timestamp)
+            # tobytes() is the only copy of the encoded image
+            msg.header.stamp = timestamp
+            msg.data = img_encoded.tobytes()
+            pub.publish(msg)
+            delay = rospy.get_time() - timestamp.to_sec()
+            latency.record(delay)
+            latency_pub.publish(Float32(1e3 * delay)) # ms
+            sent(len(msg.data))
+        if depth_encoded is not None:
+            depth_msg.header.stamp = timestamp
+            depth_msg.data = depth_encoded
+            depth_pub.publish(depth_msg)
+
+    if pipelined:
+        run_pipelined(source, encoder_workers, stats_interval, stamp_frame, encode_frame, publish, shm, need_jpeg, depth_pub is not None)
+        return
 
     try:
         while not rospy.is_shutdown():
-            frames = pipeline.wait_for_frames()
-            color_frame = frames.get_color_frame()
-            if not color_frame:
+            image = source.read()
+            if image is None:
                 continue
             
-            # Get current timestamp
-            timestamp = rospy.Time.now()
+            # Capture time of the frame
+            timestamp = stamp_frame()
 
-            color_image = np.asanyarray(color_frame.get_data())
-            
-            # Encode image as JPEG
-            _, img_encoded = cv2.imencode('.jpg', color_image)
-            
-            # Create CompressedImage message
-            msg = CompressedImage()
-            msg.header.stamp = timestamp
-            msg.format = "jpeg"
-            msg.data = np.array(img_encoded).tobytes()
+            if shm is not None and shm.mode == 'raw':
+                shm.write(image, timestamp) # one copy from the frame memory into shared memory
+
+            # Encode straight from the frame memory (no copy)
+            encoded = encode_frame((image if need_jpeg() else None, source.depth if depth_pub is not None else None))
+            source.release() # hand the frame back to librealsense before publishing
             
-            # Publish the compressed image
-            pub.publish(msg)
+            # Publish the compressed image (and depth)
+            publish(encoded, timestamp)
                 
     except KeyboardInterrupt:
         pass
     finally:
-        pipeline.stop()
+        source.stop()
+
+def run_pipelined(source, encoder_workers, stats_interval, stamp_frame, encode_frame, publish, shm, need_jpeg, depth):
+    # capture, encoding and publishing run concurrently, see include/jpeg_pipeline.py
+    rospy.loginfo(f"Pipelined mode with {encoder_workers} encoder workers")
+
+    # one buffer per encoder and one for the capture thread, no image array is allocated per frame
+    buffers = BufferPool(source.shape, encoder_workers + 1)
+    depth_buffers = BufferPool(source.shape[:2], encoder_workers + 1, np.uint16) if depth else None
+
+    def grab():
+        image = source.read()
+        if image is None:
+            return None
+        timestamp = stamp_frame()
+        if shm is not None and shm.mode == 'raw':
+            shm.write(image, timestamp)
+        # copy out of the frame memory, so librealsense gets the frame back right away instead of after encoding
+        buf = buffers.copy_in(image) if need_jpeg() else None
+        depth_buf = depth_buffers.copy_in(source.depth) if depth and source.depth is not None else None
+        source.release()
+
+        def release():
+            if buf is not None:
+                buffers.release(buf)
+            if depth_buf is not None:
+                depth_buffers.release(depth_buf)
+
+        if buf is None and depth_buf is None:
+            release()
+            return None
+        return (buf, depth_buf), timestamp, release
+
+    def publish_new(encoded, timestamp):
+        # encoder threads publish concurrently, each with its own messages
+        publish(encoded, timestamp, CompressedImage(format="jpeg"), CompressedImage(format=DEPTH_FORMAT))
+
+    # color and depth of a frame are encoded by the same worker of the pool,
+    # the capture-to-publish latency is recorded by publish() from the frame stamp as in the sequential loop
+    jpeg = JpegPipeline(grab, publish_new, workers=encoder_workers, encode=encode_frame, measure_latency=False)
+    jpeg.start()
+
+    if stats_interval > 0:
+        rospy.Timer(rospy.Duration(stats_interval), lambda e: rospy.loginfo(jpeg.report()))
+
+    try:
+        rospy.spin()
+    finally:
+        jpeg.stop()
+        source.stop()
 
 if __name__ == '__main__':
     try:
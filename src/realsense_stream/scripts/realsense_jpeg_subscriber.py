@@ -3,32 +3,214 @@
 import rospy
 import numpy as np
 import cv2
-from sensor_msgs.msg import CompressedImage
-from cv_bridge import CvBridge
+from sensor_msgs.msg import CompressedImage, Image
 import time
+import json
+import struct
+import queue
+import threading
+import sys
+import os
+import rospkg
+
+# add the include path of the package so that interpeter can find the modules
+sys.path.append(os.path.join(rospkg.RosPack().get_path('realsense_stream'), 'include'))
+
+from pipeline_stats import StageStats, RateMeter
+from frame_slot import LatestSlot
+from decode_modes import JpegDecoder, cpu_time
+from shm_ring import ShmRingReader
 
 class ImageSubscriber:
     def __init__(self):
         rospy.init_node('image_subscriber', anonymous=True)
-        self.bridge = CvBridge()
-        self.image_sub = rospy.Subscriber('/camera/color/image_jpeg', CompressedImage, self.image_callback)
-        self.frame_count = 0
+
+        # latest_only: decode only the newest frame and skip the backlog, otherwise every received frame is decoded
+        self.latest_only = rospy.get_param('~latest_only', True)
+        # decode_workers: threads decoding in parallel (cv2.imdecode releases the GIL), 0 decodes in the callback
+        self.decode_workers = rospy.get_param('~decode_workers', 1)
+        self.stats_interval = rospy.get_param('~stats_interval', 10.0)
+        # summary_file: machine readable summary written at shutdown, e.g. to compare publisher settings
+        self.summary_file = rospy.get_param('~summary_file', '')
+        # transport: ros (CompressedImage over TCPROS) or shm (shared memory ring of a publisher on the same host)
+        self.transport_kind = rospy.get_param('~transport', 'ros')
+        self.shm_name = rospy.get_param('~shm_name', 'realsense_color')
+        self.ring = None
+        self.ring_lock = threading.Lock()
+        self.local = threading.local() # per decode thread read buffer for the shared memory frames
+        # decode_mode: color, color_2/4/8, gray, gray_2/4/8; roi: [x, y, width, height] in full resolution pixels, [] = whole image
+        self.roi = rospy.get_param('~roi', [])
+        self.decoder = JpegDecoder(rospy.get_param('~decode_mode', 'color'), self.roi)
+        # every baseline_every-th frame is also decoded as full color to measure the CPU time saving, 0 = off
+        self.baseline_every = rospy.get_param('~baseline_every', 50)
+        self.baseline = JpegDecoder('color')
+
+        # statistics over the whole run
+        self.capture_to_receipt = StageStats('capture_to_receipt', window=100000) # header stamp (capture time, hardware clock) to receipt
+        self.decode = StageStats('decode', window=100000)
+        self.decode_cpu = StageStats('decode_cpu', window=100000)
+        self.baseline_cpu = StageStats('baseline_cpu', window=100000)
+        self.payload = StageStats('payload', window=100000, scale=1e-3, unit='kB')
+        self.fps = RateMeter()
+        self.counters = {'received': 0, 'decoded': 0, 'dropped_backlog': 0, 'lost': 0, 'errors': 0, 'shm_missed': 0}
+        self.last_seq = None
+        self.lock = threading.Lock()
         self.start_time = time.time()
 
+        # frames waiting for a decode worker
+        self.frames = LatestSlot() if self.latest_only else queue.Queue()
+        self.workers = [threading.Thread(target=self.decode_loop, daemon=True) for _ in range(self.decode_workers)]
+        for worker in self.workers:
+            worker.start()
+
+        # with latest_only only the newest message is kept, buff_size must hold several frames or rospy queues them in the socket
+        if self.transport_kind == 'shm':
+            self.image_sub = rospy.Subscriber('/camera/color/image_shm', Image, self.image_callback,
+                                              queue_size=1 if self.latest_only else 100)
+        else:
+            self.image_sub = rospy.Subscriber('/camera/color/image_jpeg', CompressedImage, self.image_callback,
+                                              queue_size=1 if self.latest_only else 100, buff_size=2**24)
+
+        if self.stats_interval > 0:
+            rospy.Timer(rospy.Duration(self.stats_interval), lambda e: self.log_stats())
+        rospy.on_shutdown(self.shutdown)
+
     def image_callback(self, msg):
+        self.capture_to_receipt.record((rospy.Time.now() - msg.header.stamp).to_sec())
+        if self.transport_kind == 'ros':
+            self.payload.record(len(msg.data))
+
+        with self.lock:
+            self.counters['received'] += 1
+            # header.seq is counted up by the publisher, gaps are frames lost on the way
+            if self.last_seq is not None and msg.header.seq > self.last_seq + 1:
+                self.counters['lost'] += msg.header.seq - self.last_seq - 1
+            self.last_seq = msg.header.seq
+
+        if self.decode_workers == 0:
+            self.decode_frame(msg)
+        elif self.latest_only:
+            if self.frames.put(msg):
+                with self.lock:
+                    self.counters['dropped_backlog'] += 1
+        else:
+            self.frames.put(msg)
+
+    def decode_loop(self):
+        while not rospy.is_shutdown():
+            try:
+                msg = self.frames.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            if msg is not None:
+                self.decode_frame(msg)
+
+    def read_shm(self, msg):
+        # copy the announced frame from shared memory into the buffer of this thread, (data, encoding) or None
+        # reads are serialized with reopening, so a replaced ring is never closed while another thread copies from it
+        with self.ring_lock:
+            try:
+                if self.ring is None or self.ring.stale():
+                    self.close_ring()
+                    self.ring = ShmRingReader(self.shm_name)
+                ring = self.ring
+
+                buf = getattr(self.local, 'buf', None)
+                if buf is None or buf.size < ring.slot_size:
+                    buf = self.local.buf = np.empty(ring.slot_size, np.uint8)
+
+                seq = ring.find((msg.header.stamp.secs, msg.header.stamp.nsecs))
+                frame = ring.read(seq, out=buf) if seq is not None else None
+            except (OSError, ValueError, struct.error) as e:
+                # not there yet, or replaced by a writer with another geometry while mapped: reopen with the next frame
+                rospy.logwarn_throttle(5, f"Shared memory ring not available: {e}")
+                self.close_ring()
+                return None
+
+        if frame is None:
+            with self.lock:
+                self.counters['shm_missed'] += 1 # overwritten before it was read
+            return None
+
+        meta, data = frame
+        self.payload.record(data.size)
+        if meta['encoding'] == 'bgr8':
+            data = data.reshape(meta['height'], meta['width'], 3)
+        return data, meta['encoding']
+
+    def close_ring(self):
+        # with ring_lock held
+        if self.ring is not None:
+            self.ring.close()
+            self.ring = None
+
+    def decode_frame(self, msg):
+        data, encoding = msg.data, 'jpeg'
+        if self.transport_kind == 'shm':
+            frame = self.read_shm(msg)
+            if frame is None:
+                return None
+            data, encoding = frame
+
+        # decode (and crop) with the configured mode, the message bytes are wrapped without a copy; raw frames skip decoding
         try:
-            arr = np.frombuffer(msg.data, np.uint8)
-            image = cv2.imdecode(arr, cv2.IMREAD_COLOR)
-            self.frame_count += 1
-
-            if self.frame_count % 100 == 0:
-                elapsed_time = time.time() - self.start_time
-                self.start_time = time.time()
-                mean_fps = 100 / elapsed_time
-                rospy.loginfo("Mean FPS after {} frames: {:.2f}".format(self.frame_count, mean_fps))
+            t0, c0 = time.perf_counter(), cpu_time()
+            image = self.decoder.convert(data) if encoding == 'bgr8' else self.decoder.decode(data)
+            self.decode.record(time.perf_counter() - t0)
+            self.decode_cpu.record(cpu_time() - c0)
         except Exception as e:
+            image = None
             rospy.logerr(e)
 
+        with self.lock:
+            if image is None:
+                self.counters['errors'] += 1
+            else:
+                self.counters['decoded'] += 1
+                self.fps.tick()
+            sample = self.baseline_every > 0 and (self.counters['decoded'] - 1) % self.baseline_every == 0
+
+        if sample and image is not None and encoding == 'jpeg':
+            c0 = cpu_time()
+            self.baseline.decode(data)
+            self.baseline_cpu.record(cpu_time() - c0)
+        return image
+
+    def cpu_saving(self):
+        # CPU time saved by the decode mode relative to a full color decode, in percent
+        mode, base = self.decode_cpu.summary()['mean_ms'], self.baseline_cpu.summary()['mean_ms']
+        return 100.0 * (1.0 - mode / base) if base > 0 else 0.0
+
+    def log_stats(self):
+        rospy.loginfo("fps={:.2f} {} | {} | {} ({} saves {:.1f}% cpu) | {} | {}".format(
+            self.fps.rate(), self.capture_to_receipt, self.decode, self.decode_cpu, self.decoder.mode, self.cpu_saving(), self.payload,
+            " ".join("{}={}".format(k, v) for k, v in self.counters.items())))
+
+    def summary(self):
+        elapsed = time.time() - self.start_time
+        return {'settings': {'transport': self.transport_kind, 'latest_only': self.latest_only, 'decode_workers': self.decode_workers,
+                             'decode_mode': self.decoder.mode, 'roi': self.roi},
+                'elapsed_s': elapsed,
+                'fps': self.counters['decoded'] / elapsed if elapsed > 0 else 0.0,
+                'counters': dict(self.counters),
+                'capture_to_receipt': self.capture_to_receipt.summary(),
+                'decode': self.decode.summary(),
+                'decode_cpu': self.decode_cpu.summary(),
+                'baseline_cpu': self.baseline_cpu.summary(),
+                'cpu_saving_percent': self.cpu_saving(),
+                'payload': self.payload.summary()}
+
+    def shutdown(self):
+        if isinstance(self.frames, LatestSlot):
+            self.frames.close()
+        with self.ring_lock:
+            self.close_ring()
+        summary = json.dumps(self.summary(), indent=2)
+        rospy.loginfo("Summary:\n" + summary)
+        if self.summary_file:
+            with open(os.path.expanduser(self.summary_file), 'w') as f:
+                f.write(summary)
+
 def main():
     image_subscriber = ImageSubscriber()
     try:
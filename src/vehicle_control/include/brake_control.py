@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+
+import threading
+import time
+
+
+class BrakeScheduler:
+    """Publish brake pulses at a fixed rate from a background thread.
+
+    A brake request publishes hz * duration pulses, the same duty as the old
+    blocking rospy.Rate loop, but the caller returns immediately. Requests can
+    be extended or cancelled while the pulse train is running.
+    """
+
+    def __init__(self, publish, hz = 420, duration = 1.0, clock = time.monotonic):
+        self.publish = publish # called once per brake pulse
+        self.hz = hz
+        self.period = 1.0 / hz
+        self.duration = duration # default brake duration in seconds
+        self.clock = clock
+
+        self.remaining = 0 # pulses left in the current brake request
+        self.next_pulse = 0.0 # deadline of the next pulse
+        self.pulses_sent = 0
+        self._in_pulse = False # a pulse is being published outside of the lock
+
+        self._cond = threading.Condition()
+        self._running = True
+
+        self._thread = threading.Thread(target = self._run, name = 'brake_scheduler')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _pulses(self, duration):
+        return int(round(self.hz * (self.duration if duration is None else duration)))
+
+    @property
+    def active(self):
+        # True until the last pulse of the request was published
+        return self.remaining > 0 or self._in_pulse
+
+    def start(self, duration = None):
+        # brake for at least `duration` seconds from now, a running request is not shortened
+        with self._cond:
+            if self.remaining <= 0:
+                self.next_pulse = self.clock()
+            self.remaining = max(self.remaining, self._pulses(duration))
+            self._cond.notify()
+
+    def extend(self, duration = None):
+        # append `duration` seconds to the current request (or start a new one)
+        with self._cond:
+            if self.remaining <= 0:
+                self.next_pulse = self.clock()
+            self.remaining += self._pulses(duration)
+            self._cond.notify()
+
+    def cancel(self):
+        with self._cond:
+            self.remaining = 0
+            self._cond.notify()
+
+    def shutdown(self):
+        with self._cond:
+            self._running = False
+            self.remaining = 0
+            self._cond.notify()
+        self._thread.join(timeout = 1.0)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._running:
+                    if self.remaining <= 0:
+                        self._cond.wait()
+                        continue
+
+                    delay = self.next_pulse - self.clock()
+                    if delay <= 0:
+                        break
+                    self._cond.wait(delay)
+
+                if not self._running:
+                    return
+
+                self._in_pulse = True # before the decrement, active never reads False in between
+                self.remaining -= 1
+                # deadline based schedule, a late pulse does not cause a burst of catch-up pulses
+                now = self.clock()
+                self.next_pulse += self.period
+                if self.next_pulse < now:
+                    self.next_pulse = now + self.period
+
+            # publish outside of the lock so start/cancel never wait for the publisher
+            try:
+                self.publish()
+            finally:
+                self._in_pulse = False
+            self.pulses_sent += 1
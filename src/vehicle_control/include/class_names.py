@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+
+import ast
+import numpy as np
+
+
+def parse_class_names(value):
+    # The object detection sets '/class_names_param' to the string of a python dict,
+    # e.g. "{0: 'green', 1: 'red'}". Returns an object array with the name at the index of its class id.
+    if isinstance(value, str):
+        value = ast.literal_eval(value)
+
+    class_names = {int(k): str(v) for k, v in value.items()}
+    names = np.full(max(class_names) + 1 if class_names else 0, '', dtype = object)
+    for class_id, name in class_names.items():
+        if class_id >= 0:
+            names[class_id] = name
+
+    return names
+
+
+class ClassNameCache:
+    """Class id -> class name lookup that is only rebuilt when the parameter changes.
+
+    `fetch` returns the raw parameter value (or None if it is not set) and is
+    only called from refresh(), e.g. on a slow rospy.Timer, never per message.
+    """
+
+    def __init__(self, fetch):
+        self.fetch = fetch
+        self.raw = None
+        self.names = np.zeros(0, dtype = object)
+        self.version = 0 # incremented on every change of the class names
+        self._masks = {}
+
+    def refresh(self):
+        # returns True if the class names changed
+        raw = self.fetch()
+        if raw is None or raw == self.raw:
+            return False
+
+        names = parse_class_names(raw)
+
+        # swap in a complete new lookup, readers never see a half built one
+        self.names, self._masks = names, {}
+        self.raw = raw
+        self.version += 1
+        return True
+
+    def lookup(self, class_ids):
+        # vectorized id -> name, unknown ids map to ''
+        names = self.names
+        class_ids = np.asarray(class_ids, dtype = int)
+        valid = (class_ids >= 0) & (class_ids < len(names))
+        out = np.full(class_ids.shape, '', dtype = object)
+        out[valid] = names[class_ids[valid]]
+        return out
+
+    def name(self, class_id):
+        names = self.names
+        return names[class_id] if 0 <= class_id < len(names) else ''
+
+    def mask(self, class_names):
+        # boolean lookup array indexed by class id, True for ids whose name is in class_names
+        key = frozenset(class_names)
+        masks = self._masks
+        if key not in masks:
+            masks[key] = np.array([n in key for n in self.names], dtype = bool)
+        return masks[key]
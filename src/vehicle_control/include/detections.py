@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+
+import numpy as np
+
+# one row per detection in /yolo/multi_array: class_id, x1, y1, x2, y2, confidence
+DETECTION_DTYPE = np.dtype([('class_id', np.float32), ('x1', np.float32), ('y1', np.float32),
+                            ('x2', np.float32), ('y2', np.float32), ('confidence', np.float32)])
+
+# class names from the object detection
+GREEN_CLASSES = ('green',)
+STOP_CLASSES = ('red', 'orange')
+TRAFFIC_LIGHT_CLASSES = ('no_lights', 'orange', 'green', 'red', 'red_orange')
+PIT_IN_CLASSES = ('pit_in',)
+PIT_OUT_CLASSES = ('pit_out',)
+
+
+def parse_detections(msg):
+    # Float32MultiArray -> structured array with one reshape, None if the layout is missing
+    dims = msg.layout.dim
+    if len(dims) < 2:
+        return None
+
+    rows, cols = dims[0].size, dims[1].size
+    if cols < len(DETECTION_DTYPE.names):
+        return None
+
+    offset = msg.layout.data_offset
+    data = np.asarray(msg.data, dtype = np.float32)[offset:offset + rows * cols]
+    table = np.ascontiguousarray(data.reshape(rows, cols)[:, :len(DETECTION_DTYPE.names)])
+
+    return table.view(DETECTION_DTYPE).reshape(rows)
+
+
+class Hysteresis:
+    """N-of-M debouncing of a per frame boolean observation.
+
+    The state is set once n of the last m frames were True and cleared once
+    n of the last m frames were False; otherwise it keeps its value.
+    """
+
+    def __init__(self, n = 1, m = 1, state = False):
+        if not 0 < n <= m:
+            raise ValueError("Hysteresis requires 0 < n <= m, got n={}, m={}".format(n, m))
+        self.n, self.m = n, m
+        self.state = state
+        self.frames = [False] * m # ring buffer of the last m observations
+        self.idx = 0
+        self.count = 0 # number of True observations in the ring buffer
+
+    def update(self, observed):
+        observed = bool(observed)
+        self.count += observed - self.frames[self.idx]
+        self.frames[self.idx] = observed
+        self.idx = (self.idx + 1) % self.m
+
+        if self.count >= self.n:
+            self.state = True
+        elif self.m - self.count >= self.n:
+            self.state = False
+        return self.state
+
+
+class DetectionSignals:
+    """Traffic light and pit signals from the object detection.
+
+    Every frame is reduced to a few booleans with vectorized masks over class id
+    and confidence, debounced with N-of-M hysteresis.
+    """
+
+    def __init__(self, class_names, confidence = 0.8, n = 1, m = 1):
+        self.class_names = class_names # ClassNameCache
+        self.confidence = confidence
+
+        self.tl_green = Hysteresis(n, m)
+        self.tldet = Hysteresis(n, m)
+        self.pitin = Hysteresis(n, m)
+        self.pitout = Hysteresis(n, m)
+        self.pit_ride = False
+
+    def _seen(self, class_ids, confident, classes):
+        lut = self.class_names.mask(classes)
+        valid = class_ids < len(lut)
+        return bool(np.any(lut[class_ids[valid]] & confident[valid]))
+
+    def update(self, detections):
+        # returns the names of the flags that changed in this frame
+        before = self.state()
+
+        if detections is None or len(detections) == 0:
+            class_ids = np.zeros(0, dtype = np.intp)
+            confident = np.zeros(0, dtype = bool)
+        else:
+            class_ids = detections['class_id'].astype(np.intp)
+            confident = (detections['confidence'] > self.confidence) & (class_ids >= 0)
+            class_ids[~confident] = 0 # keep indices valid, they are masked out anyway
+
+        # a red or orange light overrides green within the same frame
+        green = self._seen(class_ids, confident, GREEN_CLASSES) and not self._seen(class_ids, confident, STOP_CLASSES)
+        self.tl_green.update(green)
+        self.tldet.update(self._seen(class_ids, confident, TRAFFIC_LIGHT_CLASSES))
+
+        pitin = self.pitin.state
+        pitout = self.pitout.state
+        if self.pitin.update(self._seen(class_ids, confident, PIT_IN_CLASSES)) and not pitin:
+            self.pit_ride = True
+        if self.pitout.update(self._seen(class_ids, confident, PIT_OUT_CLASSES)) and not pitout:
+            self.pit_ride = False
+
+        after = self.state()
+        return [k for k in after if after[k] != before[k]]
+
+    def state(self):
+        return {'tl_green': self.tl_green.state, 'tldet': self.tldet.state,
+                'pitin': self.pitin.state, 'pitout': self.pitout.state, 'pit_ride': self.pit_ride}
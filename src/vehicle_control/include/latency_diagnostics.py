@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+
+import rospy
+from diagnostic_msgs.msg import DiagnosticArray, DiagnosticStatus, KeyValue
+
+
+class LatencyDiagnostics:
+    """Periodically publish LatencyStats on /diagnostics (diagnostic_msgs/DiagnosticArray).
+
+    Every stage becomes one DiagnosticStatus named '<node>: <stage>' with the
+    percentiles of the samples recorded since the previous publish, so a
+    regression shows up in the next interval instead of being averaged away.
+    `warn_ms` maps stage names to a p99 limit, exceeding it reports WARN.
+    """
+
+    def __init__(self, node, stats, interval = 5.0, warn_ms = None):
+        self.node = node
+        self.stats = stats # {stage: LatencyStats}
+        self.warn_ms = warn_ms or {}
+        self.last = {name: s.checkpoint() for name, s in stats.items()}
+        self.pub = rospy.Publisher('/diagnostics', DiagnosticArray, queue_size = 1)
+        if interval > 0:
+            rospy.Timer(rospy.Duration(interval), lambda e: self.publish())
+
+    def status(self, name, stats):
+        since, self.last[name] = self.last[name], stats.checkpoint()
+        summary = stats.summary(since)
+
+        status = DiagnosticStatus(name = "{}: {}".format(self.node, name), hardware_id = self.node)
+        limit = self.warn_ms.get(name)
+        if not summary['count']:
+            status.level, status.message = DiagnosticStatus.OK, "no samples"
+        elif limit is not None and summary['p99_ms'] > limit:
+            status.level, status.message = DiagnosticStatus.WARN, "p99 {:.3f} ms > {} ms".format(summary['p99_ms'], limit)
+        else:
+            status.level, status.message = DiagnosticStatus.OK, "p99 {:.3f} ms".format(summary['p99_ms'])
+
+        status.values = [KeyValue(key, "{:.3f}".format(summary[key]) if key.endswith('_ms') else str(summary[key]))
+                         for key in ('count', 'mean_ms', 'p50_ms', 'p95_ms', 'p99_ms', 'max_ms')]
+        status.values.append(KeyValue('total_count', str(stats.count)))
+        return status
+
+    def publish(self):
+        msg = DiagnosticArray()
+        msg.header.stamp = rospy.Time.now()
+        msg.status = [self.status(name, s) for name, s in self.stats.items()]
+        self.pub.publish(msg)
+
+
+def node_latency_diagnostics(stats):
+    # LatencyDiagnostics for the running node, configured by ~diagnostics_interval and ~latency_warn_ms
+    return LatencyDiagnostics(rospy.get_name(), stats,
+                              interval = rospy.get_param("~diagnostics_interval", 5.0),
+                              warn_ms = rospy.get_param("~latency_warn_ms", {}))
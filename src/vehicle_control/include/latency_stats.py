@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+
+import math
+import time
+from bisect import bisect_right
+
+
+class LatencyStats:
+    """Histogram of the durations of a code path or pipeline stage, summarized in ms.
+
+    Durations are counted in log spaced bins between min_s and max_s, so memory
+    is fixed and record() is a bisect. Percentiles report the upper edge of the
+    bin, with 20 bins per decade that is within 12% of the true value.
+    """
+
+    def __init__(self, name, clock = time.perf_counter, min_s = 1e-6, max_s = 10.0, bins_per_decade = 20):
+        self.name = name
+        self.clock = clock
+        n = int(round(math.log10(max_s / min_s) * bins_per_decade))
+        self.edges = [min_s * 10 ** (i / float(bins_per_decade)) for i in range(n + 1)]
+        self.counts = [0] * (n + 2) # [< min_s], one per bin, [>= max_s]
+        self.count = 0
+        self.total = 0.0 # seconds
+        self.max = 0.0
+
+    def record(self, seconds):
+        self.counts[bisect_right(self.edges, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def wrap(self, fn):
+        # return fn with every call timed, e.g. as a subscriber callback
+        def timed(*args, **kwargs):
+            t0 = self.clock()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.record(self.clock() - t0)
+        return timed
+
+    def checkpoint(self):
+        # state to pass as `since` later, to summarize only what was recorded in between
+        return list(self.counts), self.count, self.total
+
+    def _upper_edge(self, idx):
+        if idx < len(self.edges):
+            return self.edges[idx]
+        return self.max # overflow bin
+
+    def percentile(self, q, since = None):
+        counts = self.counts if since is None else [c - s for c, s in zip(self.counts, since[0])]
+        n = sum(counts)
+        if not n:
+            return 0.0
+        rank = max(1, int(math.ceil(q / 100.0 * n)))
+        seen = 0
+        for idx, c in enumerate(counts):
+            seen += c
+            if seen >= rank:
+                return min(self._upper_edge(idx), self.max)
+        return self.max
+
+    def summary(self, since = None):
+        count, total = self.count, self.total
+        if since is not None:
+            count, total = count - since[1], total - since[2]
+        mean = total / count if count else 0.0
+        return {'count': count,
+                'mean_ms': 1e3 * mean,
+                'p50_ms': 1e3 * self.percentile(50, since),
+                'p95_ms': 1e3 * self.percentile(95, since),
+                'p99_ms': 1e3 * self.percentile(99, since),
+                'max_ms': 1e3 * (self.percentile(100, since) if since is not None else self.max)}
+
+    def __str__(self):
+        return "{name}: n={count} mean={mean_ms:.3f}ms p50={p50_ms:.3f}ms p95={p95_ms:.3f}ms p99={p99_ms:.3f}ms max={max_ms:.3f}ms".format(
+            name = self.name, **self.summary())
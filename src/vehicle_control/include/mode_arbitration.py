@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+
+# Mode arbitration for AckermannToVesc (Controlling.py). Pure python without rospy,
+# so it can be tested and benchmarked offline: python mode_arbitration.py
+
+
+def reference_allowed(rc_mode, ad_mode, source, dead_val, auto_val, manu_val, pdc_val):
+    # The original if-chain of AckermannToVesc.callback, used to fill the lookup table.
+    if rc_mode == manu_val and (ad_mode == manu_val or ad_mode is None):   # Option 1: the targeted mode is manu_val
+        if source == auto_val or source == pdc_val:
+            return False
+
+    if rc_mode == auto_val and (ad_mode == auto_val or ad_mode is None):   # Option 2: the targeted mode is auto_val
+        if source == manu_val or source == pdc_val:
+            return False
+
+    if rc_mode == manu_val and ad_mode == pdc_val:                         # Option 3: pdc_val with mode_rc = manu_val
+        if source == auto_val or source == manu_val:
+            return False
+
+    if rc_mode == auto_val and ad_mode == pdc_val:                         # Option 4: pdc_val with mode_rc = auto_val
+        if source == auto_val or source == manu_val:
+            return False
+
+    if rc_mode == dead_val:                                                # Option 5: deadman, nothing is forwarded
+        return False
+
+    return True
+
+
+class AllowTable(dict):
+    """Allowed sources for every (rc_mode, ad_mode) combination of the configured mode values.
+
+    A mode value outside of the configured ones is evaluated on first use.
+    Built completely before it is used, so it can be swapped in with one
+    assignment when the mode values change.
+    """
+
+    def __init__(self, dead_val, auto_val, manu_val, pdc_val):
+        self.mode_values = (dead_val, auto_val, manu_val, pdc_val)
+        modes = (None,) + self.mode_values
+        super().__init__(((rc, ad), self._allowed_sources(rc, ad)) for rc in modes for ad in modes)
+
+    def _allowed_sources(self, rc_mode, ad_mode):
+        _, auto_val, manu_val, pdc_val = self.mode_values
+        return frozenset(src for src in (auto_val, manu_val, pdc_val)
+                         if reference_allowed(rc_mode, ad_mode, src, *self.mode_values))
+
+    def __missing__(self, key):
+        sources = self[key] = self._allowed_sources(*key)
+        return sources
+
+
+class ModeArbiter:
+    """Decide whether a driving command may be forwarded to the VESC.
+
+    Holds the rc mode (remote control switch), the autonomous driving mode and
+    the pit ride flag. Arbitrating a command is a dict and a set lookup in an
+    AllowTable, either the arbiter's own or one passed with the command (e.g.
+    derived together with a parameter snapshot). The modes are set from
+    different subscriber threads, allowed() reads both at once and caches
+    nothing that could go stale.
+    """
+
+    def __init__(self, table = None, pit_speed_max = 0.5):
+        self.table = table        # AllowTable used if allowed() gets none
+        self.pit_speed_max = pit_speed_max # speed limit while driving into the pit
+
+        self._rc_mode = None      # mode selected on the remote control
+        self._ad_mode = None      # mode within self driving (autonomous or pdc)
+        self.last_rc_mode = None  # last mode received from the remote control
+        self.pit_ride = False
+
+    @property
+    def rc_mode(self):
+        return self._rc_mode
+
+    @rc_mode.setter
+    def rc_mode(self, mode):
+        self._rc_mode = mode
+
+    @property
+    def ad_mode(self):
+        return self._ad_mode
+
+    @ad_mode.setter
+    def ad_mode(self, mode):
+        self._ad_mode = mode
+
+    def allowed(self, source, table = None):
+        table = self.table if table is None else table
+        return source in table[(self._rc_mode, self._ad_mode)]
+
+    def limit_speed(self, speed, speed_acc, tl_green, tldet):
+        # Returns the limited speed and whether the car has to brake for a red light
+        if self.pit_ride and speed >= self.pit_speed_max: # pathplanner and object detection are not working at the same time, for demonstration purposes
+            speed = self.pit_speed_max
+
+        if speed_acc <= speed: # the acc speed has priority if it is lower than the commanded (stanley) speed
+            speed = speed_acc
+
+        red_light = tldet and not tl_green
+        if red_light:
+            speed = 0
+
+        return speed, red_light
+
+
+if __name__ == '__main__':
+    # micro benchmark: table lookup vs. the original if-chain
+    import timeit
+
+    arbiter = ModeArbiter(AllowTable(dead_val = 0, auto_val = 1, manu_val = 2, pdc_val = 3))
+    arbiter.rc_mode, arbiter.ad_mode = 1, 3
+    n = 1000000
+
+    t_table = timeit.timeit(lambda: arbiter.allowed(1), number = n)
+    t_chain = timeit.timeit(lambda: reference_allowed(arbiter.rc_mode, arbiter.ad_mode, 1, 0, 1, 2, 3), number = n)
+    t_limit = timeit.timeit(lambda: arbiter.limit_speed(1.0, 1000, True, False), number = n)
+
+    print("table lookup: %.3f us/call" % (1e6 * t_table / n))
+    print("if-chain:     %.3f us/call" % (1e6 * t_chain / n))
+    print("limit_speed:  %.3f us/call" % (1e6 * t_limit / n))
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+
+import xmlrpc.client
+from collections import namedtuple
+
+NO_DEFAULT = object()
+
+
+def fetch_params(keys, caller_id, master_uri = None):
+    # Fetch all keys in a single round trip to the ROS master (XML-RPC system.multicall).
+    # Returns {key: value} for the keys that are set.
+    if master_uri is None:
+        import rosgraph
+        master_uri = rosgraph.get_master_uri()
+
+    multi = xmlrpc.client.MultiCall(xmlrpc.client.ServerProxy(master_uri))
+    for key in keys:
+        multi.getParam(caller_id, key)
+
+    values = {}
+    for key, (code, _, value) in zip(keys, multi()):
+        if code == 1:
+            values[key] = value
+    return values
+
+
+class ParamCache:
+    """Immutable snapshot of a group of parameters, swapped in atomically on change.
+
+    `params` is a list of (attribute, key) or (attribute, key, default) tuples
+    and `fetch(keys)` returns {key: value} for all keys in one call. Readers
+    take `cache.snapshot` once and read plain attributes from it, so they never
+    see a half updated configuration and never talk to the master.
+
+    State derived from the parameters (messages, lookup tables, mappings) is
+    built by `derive(new, old)` from the new snapshot before anything is swapped
+    in, `cache.current` then replaces (snapshot, derived) in one assignment.
+    Readers that need both take `cfg, derived = cache.current` once. If derive
+    raises, the previous snapshot stays in place.
+    """
+
+    def __init__(self, name, params, fetch, derive = None):
+        self.params = [p if len(p) == 3 else (p[0], p[1], NO_DEFAULT) for p in params]
+        self.Snapshot = namedtuple(name, [attr for attr, _, _ in self.params])
+        self.fetch = fetch
+        self.derive = derive
+        self.current = (None, None) # (snapshot, derived state)
+
+    @property
+    def snapshot(self):
+        return self.current[0]
+
+    @property
+    def derived(self):
+        return self.current[1]
+
+    def refresh(self):
+        # returns True if the parameters changed
+        values = self.fetch([key for _, key, _ in self.params])
+
+        fields = []
+        for attr, key, default in self.params:
+            if key in values:
+                fields.append(values[key])
+            elif default is not NO_DEFAULT:
+                fields.append(default)
+            else:
+                raise KeyError(key)
+
+        snapshot = self.Snapshot(*fields)
+        if snapshot == self.snapshot:
+            return False
+
+        derived = self.derive(snapshot, self.snapshot) if self.derive is not None else None
+        self.current = (snapshot, derived)
+        return True
+
+
+def node_param_cache(name, params, derive = None):
+    # ParamCache for the running rospy node
+    import rospy
+    return ParamCache(name, params, lambda keys: fetch_params(keys, rospy.get_name()), derive)
+
+
+# Parameters of control_config.yaml used by the vehicle_control nodes
+
+VESC_PARAMS = [
+    ('servo_mid', '/servo_mid'),
+    ('servo_max', '/servo_max'),
+    ('servo_min', '/servo_min'),
+    ('erpm_min', '/erpm_min'),
+    ('brake_amps', '/brake_amps'),
+    ('speed_to_erpm_gain', '/speed_to_erpm_gain'),
+    ('steer_to_servo_gain', '/steer_to_servo_gain'),
+    ('dead_val', '/rc_dead_value'), # Deadman switch
+    ('auto_val', '/rc_auto_value'), # Drive autonomously
+    ('manu_val', '/rc_manu_value'), # Drive manually
+    ('pdc_val', '/rc_pdc_value', 3), # Drive pdc
+    ('mode_btn', '/rc_mode_button'),
+]
+
+JOY_PARAMS = [
+    ('rc_steer_ax', '/rc_steering_axis'),
+    ('rc_speed_ax', '/rc_speed_axis'),
+    ('joy_steer_ax', '/joy_steering_axis', None),
+    ('joy_speed_ax', '/joy_speed_axis', None),
+    ('steer_max', '/steering_angle_max'),
+    ('speed_min', '/speed_min'),
+    ('speed_max', '/speed_max'),
+]
+
+RC_PARAMS = [
+    ('steer_min_pwm', '/steering_min_pwm'),
+    ('steer_mid_pwm', '/steering_mid_pwm'),
+    ('steer_max_pwm', '/steering_max_pwm'),
+    ('speed_min_pwm', '/speed_min_pwm'),
+    ('speed_mid_pwm', '/speed_mid_pwm'),
+    ('speed_max_pwm', '/speed_max_pwm'),
+    ('mode_min_pwm', '/mode_min_pwm'),
+    ('mode_mid_pwm', '/mode_mid_pwm'),
+    ('mode_max_pwm', '/mode_max_pwm'),
+    ('steer_ax', '/rc_steering_axis'),
+    ('speed_ax', '/rc_speed_axis'),
+    ('mode_btn', '/rc_mode_button'),
+]
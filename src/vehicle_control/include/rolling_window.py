@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+
+
+class QuietWindow:
+    """Gate that opens once an input stayed quiet (zero) for a whole window.
+
+    Fixed size ring buffer with a running count of non-zero samples, so every
+    push is O(1) regardless of the window length.
+    """
+
+    def __init__(self, size):
+        if size < 1:
+            raise ValueError("QuietWindow size must be at least 1, got {}".format(size))
+        self.size = size
+        self.reset()
+
+    @classmethod
+    def from_duration(cls, seconds, hz):
+        # window covering `seconds` of an input published at `hz`
+        return cls(int(round(seconds * hz)))
+
+    def reset(self):
+        self.buf = [False] * self.size # True where the sample was non-zero
+        self.idx = 0
+        self.filled = 0
+        self.active = 0 # number of non-zero samples in the window
+
+    def push(self, value):
+        # add a sample, returns True if the window is full and all samples are zero
+        active = value != 0
+        self.active += active - self.buf[self.idx]
+        self.buf[self.idx] = active
+        self.idx = (self.idx + 1) % self.size
+        if self.filled < self.size:
+            self.filled += 1
+        return self.quiet
+
+    @property
+    def quiet(self):
+        return self.filled == self.size and self.active == 0
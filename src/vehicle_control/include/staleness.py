@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+
+import threading
+import time
+
+
+class StalenessTracker:
+    """Latest value of several inputs, each expiring after its own timeout.
+
+    Expiry is a deadline comparison when a value is read, so nothing runs while
+    messages arrive in time. If `schedule(delay, fn)` is given (e.g. a one-shot
+    rospy.Timer), inputs with an on_expire callback get at most one pending
+    timer, which fires once the deadline has really passed.
+    """
+
+    def __init__(self, clock = time.monotonic, schedule = None):
+        self.clock = clock
+        self.schedule = schedule
+        self.inputs = {}
+        self._lock = threading.Lock()
+
+    def add(self, name, timeout, on_expire = None):
+        self.inputs[name] = {'timeout': timeout, 'on_expire': on_expire, 'value': None,
+                             'stamp': None, 'deadline': None, 'armed': False}
+
+    def update(self, name, value):
+        entry = self.inputs[name]
+        now = self.clock()
+        with self._lock:
+            entry['value'] = value
+            entry['stamp'] = now
+            entry['deadline'] = now + entry['timeout']
+            arm = entry['on_expire'] is not None and self.schedule is not None and not entry['armed']
+            entry['armed'] = entry['armed'] or arm
+
+        if arm:
+            self.schedule(entry['timeout'], lambda: self._check(name))
+
+    def _check(self, name):
+        # deadline timer: expire the input or re-arm for the remaining time if it was updated meanwhile
+        entry = self.inputs[name]
+        with self._lock:
+            remaining = entry['deadline'] - self.clock()
+            if remaining > 0:
+                expired = False
+            else:
+                expired = entry['value'] is not None
+                entry['value'] = None
+                entry['armed'] = False
+
+        if remaining > 0:
+            self.schedule(remaining, lambda: self._check(name))
+        elif expired:
+            entry['on_expire'](name)
+
+    def get(self, name):
+        # latest value, or None if it never arrived or is older than its timeout
+        entry = self.inputs[name]
+        deadline = entry['deadline']
+        if deadline is None or self.clock() > deadline:
+            return None
+        return entry['value']
+
+    def is_stale(self, name):
+        return self.get(name) is None
+
+    def age(self, name):
+        # seconds since the last update, None if the input never arrived
+        stamp = self.inputs[name]['stamp']
+        return None if stamp is None else self.clock() - stamp
+
+    def ages(self):
+        return {name: self.age(name) for name in self.inputs}
@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+
+import threading
+import time
+
+
+class VescOutput:
+    """Latest-wins output stage between the command arbitration and the VESC topics.
+
+    submit() only stores the newest command, flush() writes it, either at a
+    fixed rate from a timer or directly from submit() in passthrough mode.
+    A channel (servo, motor) is not written again while its value stays within
+    the tolerance, but at least every `keepalive` seconds as long as commands
+    arrive, so the VESC timeout does not cut the motor at constant speed.
+
+    While `hold_motor()` returns True (e.g. a running BrakeScheduler owns the
+    motor channel) no erpm or brake command is taken or written, only the servo.
+
+    Counters: `coalesced` commands were replaced by a newer one before being
+    sent, `dropped` writes were skipped because the value did not change,
+    `held` motor commands were discarded during hold_motor().
+    """
+
+    def __init__(self, publish_servo, publish_erpm, publish_brake, passthrough = False,
+                 servo_tol = 1e-3, erpm_tol = 10.0, keepalive = 0.1, on_flush = None, hold_motor = None, clock = time.monotonic):
+        self.publish_servo = publish_servo
+        self.publish_erpm = publish_erpm
+        self.publish_brake = publish_brake
+        self.passthrough = passthrough
+        self.servo_tol = servo_tol
+        self.erpm_tol = erpm_tol
+        self.keepalive = keepalive
+        self.on_flush = on_flush # called with the origin of every flushed command, e.g. for latency stats
+        self.hold_motor = hold_motor
+        self.clock = clock
+
+        self._lock = threading.Lock()
+        self._pending = None
+        self.submitted = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.written = 0
+        self.held = 0
+        self.clear()
+
+    def clear(self):
+        # forget the pending and last written command, e.g. on a mode change or brake
+        with self._lock:
+            self._pending = None
+            self._servo = None # (value, write time)
+            self._motor = None # (('erpm' | 'brake', value), write time)
+
+    def _holding(self):
+        return self.hold_motor is not None and self.hold_motor()
+
+    def submit(self, servo, erpm, brake, origin = None):
+        # brake: send `brake` amps on the brake topic instead of `erpm`
+        holding = self._holding()
+        with self._lock:
+            self.submitted += 1
+            if self._pending is not None:
+                self.coalesced += 1
+            if holding:
+                self.held += 1
+                erpm = brake = None # servo only
+            self._pending = (servo, erpm, brake, origin)
+
+        if self.passthrough:
+            self.flush()
+
+    def _due(self, last, value, tol, now):
+        return last is None or now - last[1] >= self.keepalive or abs(value - last[0]) > tol
+
+    def flush(self):
+        # write the latest command, called at the output rate
+        holding = self._holding()
+        with self._lock:
+            pending, self._pending = self._pending, None
+            if pending is None:
+                return
+            servo, erpm, brake, origin = pending
+            now = self.clock()
+
+            write_servo = self._due(self._servo, servo, self.servo_tol, now)
+            if write_servo:
+                self._servo = (servo, now)
+
+            if holding or (erpm is None and brake is None):
+                # submitted before the hold started or during it, the first command after the hold is always written
+                self.held += holding and (erpm is not None or brake is not None)
+                self._motor = None
+                write_motor = False
+            else:
+                motor = ('brake', brake) if brake is not None else ('erpm', erpm)
+                last = self._motor
+                write_motor = (last is None or last[0][0] != motor[0]
+                               or self._due((last[0][1], last[1]), motor[1], 0.0 if brake is not None else self.erpm_tol, now))
+                if write_motor:
+                    self._motor = (motor, now)
+                self.dropped += not write_motor
+
+            self.written += write_servo + write_motor
+            self.dropped += not write_servo
+
+        if write_servo:
+            self.publish_servo(servo)
+        if write_motor:
+            if brake is not None:
+                self.publish_brake(brake)
+            else:
+                self.publish_erpm(erpm)
+
+        if self.on_flush is not None:
+            self.on_flush(origin)
+
+    def counters(self):
+        return {'submitted': self.submitted, 'coalesced': self.coalesced,
+                'dropped': self.dropped, 'written': self.written, 'held': self.held}
+
+    def __str__(self):
+        return "vesc_output: submitted={submitted} coalesced={coalesced} dropped={dropped} written={written} held={held}".format(**self.counters())
+
+
+if __name__ == '__main__':
+    # one second of planner commands at 200 Hz with jitter below the tolerance into a 50 Hz output stage
+    now = [0.0]
+    writes = []
+    out = VescOutput(lambda v: writes.append(('servo', v)), lambda v: writes.append(('erpm', v)),
+                     lambda v: writes.append(('brake', v)), clock = lambda: now[0])
+
+    for i in range(200):
+        now[0] = i * 0.005
+        out.submit(0.5 + 0.0001 * (i % 3), 3500.0, None)
+        if i % 4 == 3:
+            out.flush()
+
+    print(out)
+    print("writes: {} (without the output stage: {})".format(len(writes), 2 * 200))
@@ -7,40 +7,67 @@ from sensor_msgs.msg import Joy
 from std_msgs.msg import Float64, Bool, Float32MultiArray
 from nav_msgs.msg import Path
 import time
+import sys
+import json
+from collections import namedtuple
+import os
+import rospkg
 from vehicle_control.srv import ChangeStatus, ChangeStatusResponse
-pit_ride = False
-mode_ad = None 
-laststatus_joy = None
+
+# add the include path of the package so that interpeter can find the modules
+sys.path.append(os.path.join(rospkg.RosPack().get_path('vehicle_control'), 'include'))
+
+from brake_control import BrakeScheduler
+from latency_stats import LatencyStats
+from vesc_output import VescOutput
+from latency_diagnostics import node_latency_diagnostics
+from param_cache import node_param_cache, VESC_PARAMS
+from rolling_window import QuietWindow
+from mode_arbitration import ModeArbiter, AllowTable
+from class_names import ClassNameCache
+from detections import DetectionSignals, parse_detections
+from staleness import StalenessTracker
+
+
+# State derived from the VescConfig snapshot
+VescState = namedtuple('VescState', ['brake_msg', 'allow_table'])
 
 class AckermannToVesc:
-    def __init__(self, dynamic_update = False, interval = 10):
-        # Load configuration parameters for mapping and mode settings
+    def __init__(self, dynamic_update = False, interval = 10, fused = False):
+        # fused: /rc/joy and /rc/ackermann_cmd are not subscribed, fused_control.py calls on_rc_joy and on_rc_ackermann in-process
+        self.fused = fused
+        self.rc_enabled = False						# True once the safety check passed
+        # Mode arbitration: rc mode, autonomous driving mode and pit ride state, the allow table comes with the parameters
+        self.arbiter = ModeArbiter()
+
+        # Load configuration parameters for mapping and mode settings as one immutable snapshot (self.cfg),
+        # swapped in together with the state derived from it (brake message and allow table)
+        self.params = node_param_cache('VescConfig', VESC_PARAMS, self.derive_params)
         self.load_params()
-        #self.class_names_str = rospy.get_param('/class_names_param')
-        #self.class_names_str = self.class_names_str.strip('{}')
-        #self.class_names_list = self.class_names_str.split(', ')
-        #self.class_names_dict = {}
-        #for item in self.class_names_list:
-        #    key, value = item.split(': ')
-        #    self.class_names_dict[int(key)] = value.strip("'")
+
+        # Class names of the object detection, fetched once and refreshed on a slow timer instead of per message
+        self.class_names = ClassNameCache(lambda: rospy.get_param('/class_names_param', None))
+        self.refresh_class_names()
+        class_names_interval = rospy.get_param("~class_names_interval", 5.0)
+        rospy.Timer(rospy.Duration(class_names_interval), lambda e: self.refresh_class_names())
 
         # Initialize modes as None indicating no mode is set initially
         self.mode = None
-        
-        # Initialize messages for publishing speed and servo position
-        self.erpm_msg = Float64()
-        self.servo_msg = Float64()
-        
-        # Initialize brake message
-        self.brake_msg = Float64()
-        self.brake_msg.data = self.brake_amps
+
+        # The brake message (self.brake_msg) is created from brake_amps in derive_params
+
+        # Record how long each callback blocks its subscriber thread
+        self.cb_stats = {name: LatencyStats(name) for name in ('update_mode', 'update_self_driving_mode', 'callback')}
+        self.timed_callback = self.cb_stats['callback'].wrap(self.callback)
+
+        # Per stage latency of the driving commands, from the origin stamp in the ackermann header (rc receipt, joy_node or planner)
+        self.stages = {name: LatencyStats(name) for name in ('input_age', 'arbitration', 'publish', 'end_to_end')}
 
         # Safety check parameters and subscriber
-        self.speed_values = []  # Stores speed values for safety check
-        n_seconds = 8  # Duration for the safety check in seconds
-        hz = 40  # Expected number of speed values per second
-        self.min_values = n_seconds * hz  # Minimum number of values for a valid safety check
-        self.safety_sub = rospy.Subscriber('/rc/ackermann_cmd', AckermannDriveStamped, self.safety_check)
+        n_seconds = rospy.get_param("/safety_check_seconds", 8)  # Duration for the safety check in seconds
+        hz = rospy.get_param("/safety_check_hz", 40)  # Expected number of speed values per second
+        self.speed_window = QuietWindow.from_duration(n_seconds, hz)  # Speed has to stay 0 for the whole window
+        self.safety_sub = None if fused else rospy.Subscriber('/rc/ackermann_cmd', AckermannDriveStamped, self.safety_check)
         
         # Driving command subscribers, initially not active
         self.rc_sub = None	 			# Messages from RC
@@ -50,23 +77,33 @@ class AckermannToVesc:
         self.tldet = False	 			# traffic light not detected
         self.pitin = False 	 			# parallelparking false
         self.pitout = False
-        self.pathbox = Path()				# initialize path in box
-        self.pathtrack = Path()			# initialize path on track
-        self.last_timebox = rospy.Time.now()		# initialize timer for last received message box 
-        self.last_timetrack = rospy.Time.now()	# initialize timer for last received message track
+        self.detections = None						# last parsed detections of the object detection
+        self.signals = DetectionSignals(self.class_names,
+                                        confidence = rospy.get_param("~detection_confidence", 0.8),
+                                        n = rospy.get_param("~detection_n", 2),			# a flag changes after n of the last m frames agree
+                                        m = rospy.get_param("~detection_m", 3))
+
+        # Paths of the box and the track expire if no new message arrives within path_timeout seconds,
+        # to guarantee no old data when leaving the box. Checked by deadline, nothing polls in between.
+        path_timeout = rospy.get_param("~path_timeout", 5.0)
+        self.paths = StalenessTracker(clock = rospy.get_time,
+                                      schedule = lambda delay, fn: rospy.Timer(rospy.Duration(delay), lambda e: fn(), oneshot = True))
+        self.paths.add('pathbox', path_timeout, on_expire = self.path_expired)
+        self.paths.add('pathtrack', path_timeout, on_expire = self.path_expired)
         
         # Joystick subscriber for mode updates
-        self.joy_sub = rospy.Subscriber('/rc/joy', Joy, self.update_mode)
+        self.on_rc_joy = self.cb_stats['update_mode'].wrap(self.update_mode)
+        self.joy_sub = None if fused else rospy.Subscriber('/rc/joy', Joy, self.on_rc_joy)
 
         # Mode Subscriber for mode updates within selfdriving mode
-        self.pdc_mode_sub = rospy.Subscriber('/space_detected', Bool, self.update_self_driving_mode)
+        self.pdc_mode_sub = rospy.Subscriber('/space_detected', Bool, self.cb_stats['update_self_driving_mode'].wrap(self.update_self_driving_mode))
         
         # Subscriber for Pathplanning
         self.speed_acc_sub = rospy.Subscriber('/speed_acc', Float64, self.callback_acc)			# get speed from acc. If acc has not detected car, speed is infinite
         self.multar = rospy.Subscriber("/yolo/multi_array", Float32MultiArray, self.callbackmultar)		# get multiarray vom object detection
         # Subscribe to the /path topic
-        self.pathbox_sub = rospy.Subscriber('/pathbox', Path, self.pathplanning)				# get the path of the box (from pathplanning)  (atm not available)
-        self.pathtrack_sub = rospy.Subscriber('/pathtrack', Path, self.pathplanning)			# get the path of the track (from pathplanning)  (atm not available)
+        self.pathbox_sub = rospy.Subscriber('/pathbox', Path, self.callback_pathbox)			# get the path of the box (from pathplanning)  (atm not available)
+        self.pathtrack_sub = rospy.Subscriber('/pathtrack', Path, self.callback_pathtrack)		# get the path of the track (from pathplanning)  (atm not available)
         
         # Publish Path to Stanley 
         self.path_pub = rospy.Publisher('/path', Path, queue_size=5)	# send the path to the controller
@@ -76,6 +113,26 @@ class AckermannToVesc:
         self.erpm_pub = rospy.Publisher('/commands/motor/speed', Float64, queue_size=1)
         self.servo_pub = rospy.Publisher('/commands/servo/position', Float64, queue_size=1) 
         self.brake_pub = rospy.Publisher('/commands/motor/brake', Float64, queue_size=1) 
+
+        # Brake pulses are published from a background thread, so callbacks return immediately
+        self.blocking_brake = rospy.get_param("~blocking_brake", False)	# legacy blocking brake, only for comparison
+        self.brakes = BrakeScheduler(lambda: self.brake_pub.publish(self.brake_msg), hz = 420, duration = 1.0)
+        rospy.on_shutdown(self.brakes.shutdown)
+
+        # Latest-wins output stage: commands of all sources are coalesced and sent at ~output_rate (0 = publish every command),
+        # unchanged values are only repeated every ~output_keepalive seconds to keep the VESC timeout from cutting the motor
+        output_rate = self.output_rate = rospy.get_param("~output_rate", 50.0)
+        self.output = VescOutput(lambda v: self.servo_pub.publish(Float64(v)),
+                                 lambda v: self.erpm_pub.publish(Float64(v)),
+                                 lambda v: self.brake_pub.publish(Float64(v)),
+                                 passthrough = output_rate <= 0,
+                                 servo_tol = rospy.get_param("~servo_tolerance", 1e-3),
+                                 erpm_tol = rospy.get_param("~erpm_tolerance", 10.0),
+                                 keepalive = rospy.get_param("~output_keepalive", 0.1),
+                                 on_flush = self.command_sent,
+                                 hold_motor = lambda: self.brakes.active) # no speed commands while the brake pulses run
+        if output_rate > 0:
+            rospy.Timer(rospy.Duration(1.0 / output_rate), lambda e: self.output.flush())
         
         # Inform user about safety check procedure at the start of booting
         info_msg = ("Please activate 'Deadman' mode. Do not touch the throttle or steering for {} seconds. "
@@ -87,47 +144,40 @@ class AckermannToVesc:
             # Using lambda to ignore TimerEvent arg from rospy.Timer callback
             rospy.Timer(rospy.Duration(interval), lambda e: self.load_params())
 
+        # Periodically log the callback blocking times
+        stats_interval = rospy.get_param("~stats_interval", 30)
+        if stats_interval > 0:
+            rospy.Timer(rospy.Duration(stats_interval), lambda e: self.log_callback_stats())
+
+        # p50/p95/p99 of the callbacks and command stages on /diagnostics, the fused node publishes its own
+        if not fused:
+            self.diagnostics = node_latency_diagnostics(dict(self.cb_stats, **self.stages))
+
+        # summary_file: stage latencies of the whole run written at shutdown, e.g. to compare the three node
+        # and the fused rc chain with compare_latency.py
+        self.fused = fused
+        self.summary_file = rospy.get_param("~summary_file", "")
+        if self.summary_file:
+            rospy.on_shutdown(self.write_summary)
+
     def callbackmultar(self, msg):   #Multiarray subscription from object detection
-        global pit_ride
-        self.multar = self.parse_multiarr(msg)
-        self.class_names_str = rospy.get_param('/class_names_param') 						# Extract parameters from object detection
-        self.class_names_str = self.class_names_str.strip('{}')
-        self.class_names_list = self.class_names_str.split(', ')
-        self.class_names_dict = {}
-        for item in self.class_names_list:
-            key, value = item.split(': ')
-            self.class_names_dict[int(key)] = value.strip("'")							# Extract Infromation from multiarray
-        if self.multar is not None:											# if the array is filled wih parameters
-            self.multar = self.replace_class_ids_with_names(self.multar, self.class_names_dict)			# replace IDs with names
-            for item in self.multar:											# Search multiarray and set booleans
-                class_name = item.get('class_name')									# Important parameters: class name and confidence (security feature)
-                confidence = item.get('confidence', 0)
-
-                if class_name in ['green', 'orange'] and confidence > 0.8:						# detect if traffic light is green
-                    self.tl_green = True
-                
-                if class_name in ['no_lights', 'orange', 'green', 'red', 'red_orange'] and confidence > 0.8:	# detect if traffic light is detected
-                    self.tldet = True
-                
-                if class_name == 'pit_in' and confidence > 0.8:							# set pitride true
-                    self.pitin = True
-                    self.pitout = False
-                    pit_ride = True
-                    msg = Bool()
-                    msg.data = True
-                    self.pit_ride_pub.publish(msg)
-                
-                if class_name == 'pit_out' and confidence > 0.8:							# set pitride false
-                    self.pitout = True
-                    self.pitin = False
-                    pit_ride = False
-                    msg = Bool()
-                    msg.data = False
-                    self.pit_ride_pub.publish(msg)
-                    
-                if class_name in ['red', 'orange'] and confidence > 0.8:					# Reset tl_green if red or orange is detected						
-                    self.tl_green = False 
-                print("tl_green: {}, tldet: {}, pitin: {}, pitout: {}, pit_ride: {}".format(self.tl_green, self.tldet, self.pitin, self.pitout, pit_ride))
+        self.detections = parse_detections(msg)								# structured array: class_id, x1, y1, x2, y2, confidence
+        if self.detections is None:											# no layout, nothing to evaluate
+            return
+
+        changed = self.signals.update(self.detections)							# vectorized class/confidence masks with N-of-M hysteresis
+        if not changed:												# only act and publish if a flag changed
+            return
+
+        state = self.signals.state()
+        self.tl_green, self.tldet = state['tl_green'], state['tldet']
+        self.pitin, self.pitout = state['pitin'], state['pitout']
+
+        if 'pit_ride' in changed:
+            self.arbiter.pit_ride = state['pit_ride']
+            self.pit_ride_pub.publish(Bool(state['pit_ride']))
+
+        rospy.loginfo("tl_green: {tl_green}, tldet: {tldet}, pitin: {pitin}, pitout: {pitout}, pit_ride: {pit_ride}".format(**state))
     
     
     def callback_acc(self, msg):											# set the subscibed data in self.speed_acc
@@ -146,47 +196,24 @@ class AckermannToVesc:
     	self.boxpp = msg.data        	
     
     def callback_pathbox(self, msg): 							# set the data coming from the pathbox subscriber and put it into self.pathplanning for stanley 
-    	self.pathbox = msg.data
-    	self.last_timebox = rospy.Time.now()
+    	self.paths.update('pathbox', msg)
     	self.pathplanning() 								# calling the pathpalanning function to generate a path msg to publish to stanley
     	
     def callback_pathtrack(self, msg): 						# set the data coming from the pathtrack subscriber and put it into self.pathplanning for stanley
-    	self.pathtrack = msg.data
-    	self.last_timetrack = rospy.Time.now()
+    	self.paths.update('pathtrack', msg)
     	self.pathplanning() 								# calling the pathpalanning function to generate a path msg to publish to stanley    	
-    
-    def replace_class_ids_with_names(self, multiarray, class_names_dict):
-        for item in multiarray:
-            class_id = item.get('class_id')
-            if class_id in class_names_dict:
-                item['class_name'] = class_names_dict[class_id]
-        return multiarray
-    
-    def parse_multiarr(self, msg):							# Extract the dimensions from the message
-        if msg.layout.dim:
-            rows = msg.layout.dim[0].size
-            cols = msg.layout.dim[1].size
-        else:
-            return
 
-        data = []
-        for i in range(rows):
-            start_index = i * cols
-            end_index = start_index + cols
-            row = msg.data[start_index:end_index]
-            class_id, x1, y1, x2, y2, confidence = row
-            entry = {
-                'class_id': int(class_id),
-                'x1': int(x1),
-                'y1': int(y1),
-                'x2': int(x2),
-                'y1': int(y1),
-                'confidence': float(confidence)}
-        
-            data.append(entry)
+    def path_expired(self, name):							# called once by the deadline timer if a path was not updated in time
+        rospy.logwarn("{} is stale (last message {:.1f} s ago), ignoring it".format(name, self.paths.age(name)))
+        self.pathplanning()
     
-        return data
-    	
+    def refresh_class_names(self):						# only called from the timer, keeps the parameter server out of the detection callback
+        try:
+            if self.class_names.refresh():
+                rospy.loginfo("Class names updated: {}".format(list(self.class_names.names)))
+        except (ValueError, SyntaxError, AttributeError) as e:
+            rospy.logwarn("Invalid /class_names_param: {}".format(e))
+
     def is_path_empty(self, path):							# Cecking of the subscribed path is empty
         if path is None or not path.poses:
             return True
@@ -194,18 +221,21 @@ class AckermannToVesc:
     
     
     def pathplanning(self): 								# generate publisher data for stanley  
-        if pit_ride:
-            if self.is_path_empty(self.pathbox):					# if messsage for pitride path is empty, th car stays on the track
-                path = self.pathtrack
+        pathbox = self.paths.get('pathbox')						# None if stale
+        pathtrack = self.paths.get('pathtrack')
+        if self.arbiter.pit_ride:
+            if self.is_path_empty(pathbox):						# if messsage for pitride path is empty, th car stays on the track
+                path = pathtrack
             else:
-                path = self.pathbox
+                path = pathbox
         else: 										# if pitride is false, so no signs are deteced and there is a track of the box, the car drives into the bo 
-            if self.is_path_empty(self.pathtrack):
-                path = self.pathbox
+            if self.is_path_empty(pathtrack):
+                path = pathbox
             else:
-                path = self.pathtrack							# otherwise the car drives on the track
+                path = pathtrack							# otherwise the car drives on the track
             
-        
+        if path is None:								# both paths are stale
+            return
             
         self.path_pub.publish(path)    
     
@@ -229,11 +259,49 @@ class AckermannToVesc:
     
     def initialize_subscribers(self):							# Initialize subscribers for manual and autonomous driving commands, so these go to the callback.
         if self.rc_sub is None and self.ad_sub is None:
-            self.rc_sub = rospy.Subscriber('/rc/ackermann_cmd', AckermannDriveStamped, lambda x: self.callback(x, self.manu_val))
-            self.ad_sub = rospy.Subscriber('/autonomous/ackermann_cmd', AckermannDriveStamped, lambda x: self.callback(x, self.auto_val))
-            self.pdc_sub = rospy.Subscriber('/pdc/ackermann_cmd', AckermannDriveStamped, lambda x: self.callback(x, self.pdc_val))
+            self.rc_enabled = True
+            if not self.fused:
+                self.rc_sub = rospy.Subscriber('/rc/ackermann_cmd', AckermannDriveStamped, lambda x: self.timed_callback(x, self.cfg.manu_val))
+            self.ad_sub = rospy.Subscriber('/autonomous/ackermann_cmd', AckermannDriveStamped, lambda x: self.timed_callback(x, self.cfg.auto_val))
+            self.pdc_sub = rospy.Subscriber('/pdc/ackermann_cmd', AckermannDriveStamped, lambda x: self.timed_callback(x, self.cfg.pdc_val))
+
+    def on_rc_ackermann(self, ackermann_msg):						# In-process replacement of the /rc/ackermann_cmd subscribers (fused pipeline)
+        if self.rc_enabled:
+            self.timed_callback(ackermann_msg, self.cfg.manu_val)
+        else:
+            self.safety_check(ackermann_msg)
 
-    def brake(self):									# Publishes the brake message hz times in rapid succession, causing a blocking effect.
+    def brake(self, duration = None):							# Brake for one second (default) in the background, returns immediately
+        if self.blocking_brake:
+            self.brake_blocking()
+        else:
+            self.brakes.start(duration)
+        self.output.clear() # never send a command from before the brake
+
+    def command_sent(self, origin):
+        # called by the output stage for every flushed command, Float64 has no header so the end to end latency ends here
+        if origin is not None and not origin.is_zero():
+            self.stages['end_to_end'].record((rospy.Time.now() - origin).to_sec())
+
+    def cancel_brake(self):
+        self.brakes.cancel()
+
+    def write_summary(self):
+        summary = {'configuration': 'fused' if self.fused else 'nodes',
+                   'output_rate': self.output_rate,
+                   'stages': {name: stats.summary() for name, stats in self.stages.items()},
+                   'output': self.output.counters()}
+        with open(os.path.expanduser(self.summary_file), 'w') as f:
+            json.dump(summary, f, indent = 2, sort_keys = True)
+        rospy.loginfo("latency summary written to {}".format(self.summary_file))
+
+    def log_callback_stats(self):
+        for stats in list(self.cb_stats.values()) + list(self.stages.values()):
+            if stats.count:
+                rospy.loginfo(str(stats))
+        rospy.loginfo(str(self.output))
+
+    def brake_blocking(self):								# Publishes the brake message hz times in rapid succession, causing a blocking effect.
         hz = 420
         
         rate = rospy.Rate(hz)  
@@ -243,163 +311,109 @@ class AckermannToVesc:
             rate.sleep()
                 
     def update_mode(self, msg):							# Update the driving mode based on joystick input
-        global laststatus_joy
-        global mode_ad
-        new_mode = msg.buttons[self.mode_btn]						# New mode is set to button mode					 
-        laststatus_joy = new_mode							# laststaus is also set to button mode
+        new_mode = msg.buttons[self.cfg.mode_btn]						# New mode is set to button mode					 
+        self.arbiter.last_rc_mode = new_mode						# laststaus is also set to button mode
         if new_mode != self.mode: 							# if the mode changes the car brakes
             self.brake() # emergency brake
             
             self.mode = new_mode							# mode is set to the new mode
-            if self.mode == self.dead_val: 						# if mode is deadman the autonmous driving mode is set to none
-                mode_ad = None
+            self.arbiter.rc_mode = new_mode
+            if self.mode == self.cfg.dead_val: 						# if mode is deadman the autonmous driving mode is set to none
+                self.arbiter.ad_mode = None
             
-            mode_name = {self.dead_val: "Deadman", self.auto_val: "Autonomous", self.manu_val: "Manual"}.get(self.mode, "Unknown")	
+            mode_name = {self.cfg.dead_val: "Deadman", self.cfg.auto_val: "Autonomous", self.cfg.manu_val: "Manual"}.get(self.mode, "Unknown")	
             rospy.loginfo("Mode changed to: {}".format(mode_name))			# Send changed mode to terminal
             
     def update_self_driving_mode(self, msg):						# Update the driving mode based on the selfdriving input (PDC or Autonomous)
-        global mode_ad	
-        global laststatus_joy
         space_detected = msg.data  
          
         if space_detected != True:					# after leaving the parking space the space_detected is set to false, so the autonomous driving mode is set to the last status
-            mode_ad = laststatus_joy   
+            self.arbiter.ad_mode = self.arbiter.last_rc_mode
             return        
-        new_mode = self.pdc_val					# if space detected is true the new mode is PDC, so the Parking team can continue their parking
+        new_mode = self.cfg.pdc_val					# if space detected is true the new mode is PDC, so the Parking team can continue their parking
         
-        if new_mode != mode_ad: 
+        if new_mode != self.arbiter.ad_mode: 
             self.brake() # emergency brake				# if the mode changes the car brakes
             #mode_ad = new_mode    					# setting the autonomous mode to the new mode
-            #mode_name = {self.pdc_val: "PDC"}.get(self.mode)
+            #mode_name = {self.cfg.pdc_val: "PDC"}.get(self.mode)
             #rospy.loginfo("Mode changed to: {}".format(mode_name))	# Send changed mode to terminal
             
     def safety_check(self, ackermann_msg):
         """Perform safety checks before enabling driving commands."""
-        if self.mode != self.dead_val:
+        if self.mode != self.cfg.dead_val:
             return
         
         speed = ackermann_msg.drive.speed				# Track vehicle speed to ensure it remains at 0 during the safety check
-        self.speed_values.append(speed)
-        if len(self.speed_values) > self.min_values:
-            self.speed_values.pop(0)
-            if max(self.speed_values) == 0 and min(self.speed_values) == 0:
-                rospy.loginfo("Calibration complete!")
+        if self.speed_window.push(speed):				# O(1) ring buffer check, True once the whole window was 0
+            rospy.loginfo("Calibration complete!")
+            if self.safety_sub is not None:
                 self.safety_sub.unregister()  			# Unsubscribe after passing the safety check
-                self.signal_calibration_complete() 			# Publish simple sinus sweep to indicate that the calibration was complete
-                self.initialize_subscribers()  			# Activate driving command subscribers
+            self.signal_calibration_complete() 				# Publish simple sinus sweep to indicate that the calibration was complete
+            self.initialize_subscribers()  				# Activate driving command subscribers
                 
                 
     def callback(self, ackermann_msg, target):								#Process received driving commands based on the current mode.
-        global mode_ad  
-        global pit_ride 
-        
-        if self.mode == self.manu_val and (mode_ad == self.manu_val or mode_ad is None):			# Option 1: The targeted mode is manu_val 
-        	if target == self.auto_val or target == self.pdc_val:
-        		return
-        		
-        if self.mode == self.auto_val and (mode_ad == self.auto_val or mode_ad is None): 			# Option 2: The targeted mode is auto_val
-        	if target == self.manu_val or target == self.pdc_val:
-        		return
-        		
-        if self.mode == self.manu_val and mode_ad == self.pdc_val: 						# Option 3: The targeted mode is pdc_val with mode_rc = manu_val
-        	if target == self.auto_val or target == self.manu_val:
-        		return
-        		
-        if self.mode == self.auto_val and mode_ad == self.pdc_val: 						# Option 4: The targeted mode is pdc_val with mode_rc = auto_val
-        	if target == self.auto_val or target == self.manu_val:
-        		return
-        		
-        if self.mode == self.dead_val: 									# Option 5: The targeted mode is deadman
-        	return
-        #print("Modus: ",self.mode)
-        #print("Modusad: ",mode_ad)		
+        t0 = time.perf_counter()
+        origin = ackermann_msg.header.stamp							# zero if the sender did not stamp the command
+        if not origin.is_zero():
+            self.stages['input_age'].record((rospy.Time.now() - origin).to_sec())
+
+        cfg, state = self.params.current							# one consistent parameter snapshot and derived state for the whole command
+        if not self.arbiter.allowed(target, state.allow_table):				# (rc_mode, ad_mode, source) table lookup, see mode_arbitration.py
+            return
+
         # Convert Ackermann message to VESC-compatible commands
         steering_angle = ackermann_msg.drive.steering_angle
-        speed = ackermann_msg.drive.speed
-        if pit_ride:      # because pathplanner and object detection are not working at the same time. for demonstration purposes
-            if speed >= 0.5: 
-                speed = 0.5 
-        
-        
-        # change the speed according to acc or stanley. The priority is on the stanley speed. If the speed_acc is bigger than the speed of the stanley. The speed is stanley speed.
-        if self.speed_acc <= speed:
-        	speed = self.speed_acc
-        
-        # Change the speed, if traffic light is red
-        if self.tl_green != True and self.tldet == True: 
-            speed = 0
+
+        # Limit the speed for pit ride, acc (lower acc speed has priority over the stanley speed) and red traffic lights
+        speed, red_light = self.arbiter.limit_speed(ackermann_msg.drive.speed, self.speed_acc, self.tl_green, self.tldet)
+        if red_light:
             self.brake()
-            
-        
         		
-        erpm = self.speed_to_erpm_gain * speed
-        servo_value = self.servo_mid + steering_angle * self.steer_to_servo_gain
+        erpm = cfg.speed_to_erpm_gain * speed
+        servo_value = cfg.servo_mid + steering_angle * cfg.steer_to_servo_gain
 
         # Ensure servo commands are within limits
-        self.servo_msg.data = max(min(servo_value, self.servo_max), self.servo_min)
-        self.erpm_msg.data = erpm
-
-        # Publish commands to VESC
-        self.servo_pub.publish(self.servo_msg)
-        
+        servo_value = max(min(servo_value, cfg.servo_max), cfg.servo_min)
 
-        if abs(erpm) < self.erpm_min:
-            self.brake_pub.publish(self.brake_msg)
-        else:
-            self.erpm_pub.publish(self.erpm_msg)
+        # Hand the command to the output stage, which publishes the latest one at the output rate
+        t1 = time.perf_counter()
+        self.stages['arbitration'].record(t1 - t0)
+        brake = cfg.brake_amps if abs(erpm) < cfg.erpm_min else None
+        self.output.submit(servo_value, erpm, brake, origin)
+        self.stages['publish'].record(time.perf_counter() - t1)
 
     def load_params(self):
-        self.servo_mid = rospy.get_param("/servo_mid")
-        self.servo_max = rospy.get_param("/servo_max")
-        self.servo_min = rospy.get_param("/servo_min")
-        
-        self.erpm_min = rospy.get_param("/erpm_min")
-        self.brake_amps = rospy.get_param("/brake_amps")
-        
-        self.speed_to_erpm_gain = rospy.get_param("/speed_to_erpm_gain")
-        self.steer_to_servo_gain = rospy.get_param("/steer_to_servo_gain")
-        
-        self.dead_val = rospy.get_param("/rc_dead_value")  # Deadman switch
-        self.auto_val = rospy.get_param("/rc_auto_value")  # Drive autonomously
-        self.manu_val = rospy.get_param("/rc_manu_value")  # Drive manually
-        self.pdc_val = rospy.get_param("/rc_pdc_value")  # Drive pdc
-        
-        self.mode_btn = rospy.get_param("/rc_mode_button")
-        
-    def monitor_pathbox(self):					# if no new data is published by path.box the data is set to none after five seconds, 
-        while not rospy.is_shutdown():				# to guarantee no old data when leaving the box
-            current_time = rospy.Time.now()
-            elapsed_time = current_time - self.last_timebox
-            
+        # One round trip to the master, the snapshot is only swapped in if a value changed
+        if self.params.refresh():
+            rospy.loginfo("Parameters loaded: {}".format(self.cfg))
 
-            if elapsed_time.to_sec() > 5:
-                self.pathbox = None      
-                	
-    def monitor_pathtrack(self):					# if no new data is published by path.track the data is set to none after five seconds, 
-        while not rospy.is_shutdown():				# to guarantee no old data when leaving the box
-            current_time = rospy.Time.now()
-            elapsed_time = current_time - self.last_timetrack
-            
+    def derive_params(self, cfg, old):
+        # Built from a new parameter snapshot before it is swapped in, the cache swaps in both at once
+        return VescState(Float64(cfg.brake_amps), AllowTable(cfg.dead_val, cfg.auto_val, cfg.manu_val, cfg.pdc_val))
 
-            if elapsed_time.to_sec() > 5:
-                self.pathtrack = None
+    @property
+    def cfg(self):
+        return self.params.snapshot
+
+    @property
+    def brake_msg(self):
+        return self.params.derived.brake_msg
                 
                 
 def handle_change_status(req):
-    global pit_ride
-    global mode_ad
-    global laststatus_joy
+    arbiter = A2V.arbiter
     rospy.loginfo("Received request from sender: {}, status: {}".format(req.sender, req.status))
     # Check if status is true, sender is "parking", and self.pitt_ride is true
-    if req.status and req.sender == "parking" and pit_ride:						# if allowed to drive into the box and sender is set to 'parking' change mode_ad to pdc. 
+    if req.status and req.sender == "parking" and arbiter.pit_ride:						# if allowed to drive into the box and sender is set to 'parking' change mode_ad to pdc. 
         print("dgdfg")											# This enables the parking team to gain access to ackermann.
         success = True
-        mode_ad = 3
-        AckermannToVesc().brake()
-        print("Modusad", mode_ad)
+        arbiter.ad_mode = A2V.cfg.pdc_val
+        A2V.brake()
+        print("Modusad", arbiter.ad_mode)
     else:
         success = False										# else: mode_ad will be set to last status
-        mode_ad = laststatus_joy
+        arbiter.ad_mode = arbiter.last_rc_mode
         
     return ChangeStatusResponse(success)
 #rosservice call /change_status "{status: true, sender: 'parking'}"
@@ -407,12 +421,13 @@ def handle_change_status(req):
 
 if __name__ == '__main__':
     rospy.init_node('ackermann_to_vesc', anonymous=True)
-    # to initialize server
-    s = rospy.Service('change_status', ChangeStatus, handle_change_status)
-    rospy.loginfo("Ready to change status.")
    
     A2V = AckermannToVesc(dynamic_update = False)
 
+    # to initialize server, after A2V exists because the handler brakes through it
+    s = rospy.Service('change_status', ChangeStatus, handle_change_status)
+    rospy.loginfo("Ready to change status.")
+
     try:
         rospy.spin()
     except KeyboardInterrupt:
@@ -6,28 +6,43 @@ from ackermann_msgs.msg import AckermannDriveStamped
 from sensor_msgs.msg import Joy
 from std_msgs.msg import Float64
 import time
+import sys
+import os
+import rospkg
+
+# add the include path of the package so that interpeter can find the modules
+sys.path.append(os.path.join(rospkg.RosPack().get_path('vehicle_control'), 'include'))
+
+from brake_control import BrakeScheduler
+from latency_stats import LatencyStats
+from vesc_output import VescOutput
+from latency_diagnostics import node_latency_diagnostics
+from param_cache import node_param_cache, VESC_PARAMS
+from rolling_window import QuietWindow
 
 class AckermannToVesc:
     def __init__(self, dynamic_update = False, interval = 10):
-        # Load configuration parameters for mapping and mode settings
+        # Load configuration parameters for mapping and mode settings as one immutable snapshot (self.cfg)
+        # swapped in together with the brake message derived from it
+        self.params = node_param_cache('VescConfig', VESC_PARAMS, self.derive_params)
         self.load_params()
 
         # Initialize mode as None indicating no mode is set initially
         self.mode = None
 
-        # Initialize messages for publishing speed and servo position
-        self.erpm_msg = Float64()
-        self.servo_msg = Float64()
-        
-        # Initialize brake message
-        self.brake_msg = Float64()
-        self.brake_msg.data = self.brake_amps
+        # The brake message (self.brake_msg) is created from brake_amps in derive_params
+
+        # Record how long each callback blocks its subscriber thread
+        self.cb_stats = {name: LatencyStats(name) for name in ('update_mode', 'callback')}
+        self.timed_callback = self.cb_stats['callback'].wrap(self.callback)
+
+        # Per stage latency of the driving commands, from the origin stamp in the ackermann header
+        self.stages = {name: LatencyStats(name) for name in ('input_age', 'arbitration', 'publish', 'end_to_end')}
 
         # Safety check parameters and subscriber
-        self.speed_values = []  # Stores speed values for safety check
-        n_seconds = 8  # Duration for the safety check in seconds
-        hz = 40  # Expected number of speed values per second
-        self.min_values = n_seconds * hz  # Minimum number of values for a valid safety check
+        n_seconds = rospy.get_param("/safety_check_seconds", 8)  # Duration for the safety check in seconds
+        hz = rospy.get_param("/safety_check_hz", 40)  # Expected number of speed values per second
+        self.speed_window = QuietWindow.from_duration(n_seconds, hz)  # Speed has to stay 0 for the whole window
         self.safety_sub = rospy.Subscriber('/rc/ackermann_cmd', AckermannDriveStamped, self.safety_check)
         
         # Driving command subscribers, initially not active
@@ -35,12 +50,32 @@ class AckermannToVesc:
         self.ad_sub = None
         
         # Joystick subscriber for mode updates
-        self.joy_sub = rospy.Subscriber('/rc/joy', Joy, self.update_mode)
+        self.joy_sub = rospy.Subscriber('/rc/joy', Joy, self.cb_stats['update_mode'].wrap(self.update_mode))
 
         # Publishers for motor speed and servo position
         self.erpm_pub = rospy.Publisher('/commands/motor/speed', Float64, queue_size=1)
         self.servo_pub = rospy.Publisher('/commands/servo/position', Float64, queue_size=1) 
         self.brake_pub = rospy.Publisher('/commands/motor/brake', Float64, queue_size=1) 
+
+        # Brake pulses are published from a background thread, so callbacks return immediately
+        self.blocking_brake = rospy.get_param("~blocking_brake", False) # legacy blocking brake, only for comparison
+        self.brakes = BrakeScheduler(lambda: self.brake_pub.publish(self.brake_msg), hz = 420, duration = 1.0)
+        rospy.on_shutdown(self.brakes.shutdown)
+
+        # Latest-wins output stage: commands of all sources are coalesced and sent at ~output_rate (0 = publish every command),
+        # unchanged values are only repeated every ~output_keepalive seconds to keep the VESC timeout from cutting the motor
+        output_rate = rospy.get_param("~output_rate", 50.0)
+        self.output = VescOutput(lambda v: self.servo_pub.publish(Float64(v)),
+                                 lambda v: self.erpm_pub.publish(Float64(v)),
+                                 lambda v: self.brake_pub.publish(Float64(v)),
+                                 passthrough = output_rate <= 0,
+                                 servo_tol = rospy.get_param("~servo_tolerance", 1e-3),
+                                 erpm_tol = rospy.get_param("~erpm_tolerance", 10.0),
+                                 keepalive = rospy.get_param("~output_keepalive", 0.1),
+                                 on_flush = self.command_sent,
+                                 hold_motor = lambda: self.brakes.active) # no speed commands while the brake pulses run
+        if output_rate > 0:
+            rospy.Timer(rospy.Duration(1.0 / output_rate), lambda e: self.output.flush())
         
         # Inform user about safety check procedure
         info_msg = ("Please activate 'Deadman' mode. Do not touch the throttle or steering for {} seconds. "
@@ -51,6 +86,14 @@ class AckermannToVesc:
         if dynamic_update:
             # Using lambda to ignore TimerEvent arg from rospy.Timer callback
             rospy.Timer(rospy.Duration(interval), lambda e: self.load_params())
+
+        # Periodically log the callback blocking times
+        stats_interval = rospy.get_param("~stats_interval", 30)
+        if stats_interval > 0:
+            rospy.Timer(rospy.Duration(stats_interval), lambda e: self.log_callback_stats())
+
+        # p50/p95/p99 of the callbacks and command stages on /diagnostics
+        self.diagnostics = node_latency_diagnostics(dict(self.cb_stats, **self.stages))
     
     def signal_calibration_complete(self):
         # Publish simple sinus sweep to indicate that the calibration was complete
@@ -72,10 +115,32 @@ class AckermannToVesc:
     def initialize_subscribers(self):
         """Initialize subscribers for manual and autonomous driving commands."""
         if self.rc_sub is None and self.ad_sub is None:
-            self.rc_sub = rospy.Subscriber('/rc/ackermann_cmd', AckermannDriveStamped, lambda x: self.callback(x, self.manu_val))
-            self.ad_sub = rospy.Subscriber('/autonomous/ackermann_cmd', AckermannDriveStamped, lambda x: self.callback(x, self.auto_val))
+            self.rc_sub = rospy.Subscriber('/rc/ackermann_cmd', AckermannDriveStamped, lambda x: self.timed_callback(x, self.cfg.manu_val))
+            self.ad_sub = rospy.Subscriber('/autonomous/ackermann_cmd', AckermannDriveStamped, lambda x: self.timed_callback(x, self.cfg.auto_val))
+
+    def brake(self, duration = None):
+        # Brake for one second (default) in the background, returns immediately
+        if self.blocking_brake:
+            self.brake_blocking()
+        else:
+            self.brakes.start(duration)
+        self.output.clear() # never send a command from before the brake
+
+    def command_sent(self, origin):
+        # called by the output stage for every flushed command, Float64 has no header so the end to end latency ends here
+        if origin is not None and not origin.is_zero():
+            self.stages['end_to_end'].record((rospy.Time.now() - origin).to_sec())
+
+    def cancel_brake(self):
+        self.brakes.cancel()
+
+    def log_callback_stats(self):
+        for stats in list(self.cb_stats.values()) + list(self.stages.values()):
+            if stats.count:
+                rospy.loginfo(str(stats))
+        rospy.loginfo(str(self.output))
 
-    def brake(self):
+    def brake_blocking(self):
         # Publishes the brake message hz times in rapid succession, causing a blocking effect.
         hz = 420
         
@@ -87,73 +152,74 @@ class AckermannToVesc:
         
     def update_mode(self, msg):
         """Update the driving mode based on joystick input."""
-        new_mode = msg.buttons[self.mode_btn]
+        new_mode = msg.buttons[self.cfg.mode_btn]
         
         if new_mode != self.mode: # mode change
             self.brake() # emergency brake
             
             self.mode = new_mode
-            mode_name = {self.dead_val: "Deadman", self.auto_val: "Autonomous", self.manu_val: "Manual"}.get(self.mode, "Unknown")
+            mode_name = {self.cfg.dead_val: "Deadman", self.cfg.auto_val: "Autonomous", self.cfg.manu_val: "Manual"}.get(self.mode, "Unknown")
             rospy.loginfo("Mode changed to: {}".format(mode_name))
 
     def safety_check(self, ackermann_msg):
         """Perform safety checks before enabling driving commands."""
-        if self.mode != self.dead_val:
+        if self.mode != self.cfg.dead_val:
             return
         
         # Track vehicle speed to ensure it remains at 0 during the safety check
         speed = ackermann_msg.drive.speed
-        self.speed_values.append(speed)
-        if len(self.speed_values) > self.min_values:
-            self.speed_values.pop(0)
-            if max(self.speed_values) == 0 and min(self.speed_values) == 0:
-                rospy.loginfo("Calibration complete!")
-                self.safety_sub.unregister()  # Unsubscribe after passing the safety check
-                self.signal_calibration_complete() # Publish simple sinus sweep to indicate that the calibration was complete
-                self.initialize_subscribers()  # Activate driving command subscribers
+        if self.speed_window.push(speed): # O(1) ring buffer check, True once the whole window was 0
+            rospy.loginfo("Calibration complete!")
+            self.safety_sub.unregister()  # Unsubscribe after passing the safety check
+            self.signal_calibration_complete() # Publish simple sinus sweep to indicate that the calibration was complete
+            self.initialize_subscribers()  # Activate driving command subscribers
                 
                 
     def callback(self, ackermann_msg, target):
            
         """Process received driving commands based on the current mode."""
+        t0 = time.perf_counter()
+        origin = ackermann_msg.header.stamp # zero if the sender did not stamp the command
+        if not origin.is_zero():
+            self.stages['input_age'].record((rospy.Time.now() - origin).to_sec())
+
         if self.mode != target:
             return
 
+        cfg = self.cfg # one consistent parameter snapshot for the whole command
+
         # Convert Ackermann message to VESC-compatible commands
         steering_angle = ackermann_msg.drive.steering_angle
         speed = ackermann_msg.drive.speed
-        erpm = self.speed_to_erpm_gain * speed
-        servo_value = self.servo_mid + steering_angle * self.steer_to_servo_gain
+        erpm = cfg.speed_to_erpm_gain * speed
+        servo_value = cfg.servo_mid + steering_angle * cfg.steer_to_servo_gain
 
         # Ensure servo commands are within limits
-        self.servo_msg.data = max(min(servo_value, self.servo_max), self.servo_min)
-        self.erpm_msg.data = erpm
+        servo_value = max(min(servo_value, cfg.servo_max), cfg.servo_min)
 
-        # Publish commands to VESC
-        self.servo_pub.publish(self.servo_msg)
-        
-
-        if abs(erpm) < self.erpm_min:
-            self.brake_pub.publish(self.brake_msg)
-        else:
-            self.erpm_pub.publish(self.erpm_msg)
+        # Hand the command to the output stage, which publishes the latest one at the output rate
+        t1 = time.perf_counter()
+        self.stages['arbitration'].record(t1 - t0)
+        brake = cfg.brake_amps if abs(erpm) < cfg.erpm_min else None
+        self.output.submit(servo_value, erpm, brake, origin)
+        self.stages['publish'].record(time.perf_counter() - t1)
 
     def load_params(self):
-        self.servo_mid = rospy.get_param("/servo_mid")
-        self.servo_max = rospy.get_param("/servo_max")
-        self.servo_min = rospy.get_param("/servo_min")
-        
-        self.erpm_min = rospy.get_param("/erpm_min")
-        self.brake_amps = rospy.get_param("/brake_amps")
-        
-        self.speed_to_erpm_gain = rospy.get_param("/speed_to_erpm_gain")
-        self.steer_to_servo_gain = rospy.get_param("/steer_to_servo_gain")
-        
-        self.dead_val = rospy.get_param("/rc_dead_value")  # Deadman switch
-        self.auto_val = rospy.get_param("/rc_auto_value")  # Drive autonomously
-        self.manu_val = rospy.get_param("/rc_manu_value")  # Drive manually
-        
-        self.mode_btn = rospy.get_param("/rc_mode_button")
+        # One round trip to the master, the snapshot is only swapped in if a value changed
+        if self.params.refresh():
+            rospy.loginfo("Parameters loaded: {}".format(self.cfg))
+
+    def derive_params(self, cfg, old):
+        # Built from a new parameter snapshot before it is swapped in, the cache swaps in both at once
+        return Float64(cfg.brake_amps)
+
+    @property
+    def cfg(self):
+        return self.params.snapshot
+
+    @property
+    def brake_msg(self):
+        return self.params.derived
 
 if __name__ == '__main__':
     rospy.init_node('ackermann_to_vesc', anonymous=True)
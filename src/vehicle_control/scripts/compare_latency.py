@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+
+# Compare the stage latencies of two runs of the rc chain, written by Controlling.py with ~summary_file at shutdown:
+#
+#    roslaunch vehicle_control manual_control.launch summary_file:=~/nodes.json
+#    roslaunch vehicle_control manual_control.launch fused:=true summary_file:=~/fused.json
+#    rosrun vehicle_control compare_latency.py ~/nodes.json ~/fused.json
+#
+# end_to_end runs from the receipt of /veh_remote_ctrl to the flush of the output stage in both configurations,
+# so its difference is what the fused process saves.
+
+import json
+import os
+import sys
+
+STAGES = ('end_to_end', 'input_age', 'arbitration', 'publish')
+KEYS = ('p50_ms', 'p95_ms', 'p99_ms', 'mean_ms')
+
+
+def load(path):
+    with open(os.path.expanduser(path)) as f:
+        return json.load(f)
+
+
+def compare(base, new):
+    # rows of (stage, key, base ms, new ms, reduction in percent) for the stages recorded in both runs
+    rows = []
+    for stage in STAGES:
+        a, b = base['stages'].get(stage), new['stages'].get(stage)
+        if not a or not b or not a['count'] or not b['count']:
+            continue
+        for key in KEYS:
+            reduction = 100.0 * (1.0 - b[key] / a[key]) if a[key] > 0 else 0.0
+            rows.append((stage, key, a[key], b[key], reduction))
+    return rows
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        print("usage: compare_latency.py <summary of the base run> <summary of the new run>")
+        sys.exit(1)
+
+    base, new = load(sys.argv[1]), load(sys.argv[2])
+    print("{:<12} {:>8}  {:>10} {:>10}  {:>9}".format('stage', '', base['configuration'], new['configuration'], 'reduction'))
+    for stage, key, a, b, reduction in compare(base, new):
+        print("{:<12} {:>8}  {:>8.3f}ms {:>8.3f}ms  {:>8.1f}%".format(stage, key[:-3], a, b, reduction))
+    for run in (base, new):
+        print("{}: {} commands, output_rate {} hz".format(run['configuration'], run['stages']['end_to_end']['count'], run['output_rate']))
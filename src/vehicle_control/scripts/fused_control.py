@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+
+# Manual control pipeline in a single process: RCJoystick -> JoyControl -> AckermannToVesc.
+# Messages are passed as in-process function calls instead of /rc/joy and /rc/ackermann_cmd,
+# which saves two TCPROS hops (serialization, context switch and queueing) per stick movement.
+
+import sys
+import os
+import rospkg
+import rospy
+from std_msgs.msg import UInt16MultiArray
+
+# the node classes live in the scripts and include folders of this package
+pkg_path = rospkg.RosPack().get_path('vehicle_control')
+sys.path.append(os.path.join(pkg_path, 'scripts'))
+sys.path.append(os.path.join(pkg_path, 'include'))
+
+import Controlling
+from rc_to_joy import RCJoystick
+from joy_to_ackermann import JoyControl
+from latency_stats import LatencyStats
+from latency_diagnostics import node_latency_diagnostics
+from vehicle_control.srv import ChangeStatus
+
+
+if __name__ == '__main__':
+
+    # initialize node
+    rospy.init_node('fused_control', anonymous=True)
+
+    # optionally keep publishing /rc/joy and /rc/ackermann_cmd, e.g. for debugging and foxglove
+    publish_intermediate = rospy.get_param("~publish_intermediate", False)
+    stats_interval = rospy.get_param("~stats_interval", 30)
+
+    a2v = Controlling.AckermannToVesc(dynamic_update = False, fused = True)
+    Controlling.A2V = a2v # used by handle_change_status
+    s = rospy.Service('change_status', ChangeStatus, Controlling.handle_change_status)
+
+    ctrl = JoyControl(subscribe = False, publish = publish_intermediate)
+    ctrl.sinks.append(a2v.on_rc_ackermann)
+
+    rcjoy = RCJoystick(subscribe = False, publish = publish_intermediate)
+    rcjoy.sinks.append(a2v.on_rc_joy) # mode update first
+    rcjoy.sinks.append(ctrl.callback)
+
+    # the whole chain up to the output stage runs in this callback, the commands go out with the next flush of the
+    # output stage; ackermann_to_vesc/end_to_end measures from the receipt of /veh_remote_ctrl to that flush,
+    # the same stage as in the three node setup (compare both with ~summary_file and compare_latency.py)
+    chain_callback = LatencyStats('chain_callback')
+    rc_sub = rospy.Subscriber('/veh_remote_ctrl', UInt16MultiArray, chain_callback.wrap(rcjoy.callback))
+
+    if stats_interval > 0:
+        rospy.Timer(rospy.Duration(stats_interval), lambda e: rospy.loginfo("{} | {}".format(chain_callback, a2v.stages['end_to_end'])))
+
+    # all stages of the chain on /diagnostics, prefixed with the stage owner
+    stats = {'chain_callback': chain_callback}
+    for prefix, stages in (('rc_to_joy', rcjoy.stages), ('joy_to_ackermann', ctrl.stages),
+                           ('ackermann_to_vesc', dict(a2v.cb_stats, **a2v.stages))):
+        stats.update(('{}/{}'.format(prefix, name), s) for name, s in stages.items())
+    diagnostics = node_latency_diagnostics(stats)
+
+    try:
+        rospy.spin()
+    except KeyboardInterrupt:
+        print("Shutting down fused_control")
@@ -4,14 +4,25 @@ import rospy
 from ackermann_msgs.msg import AckermannDriveStamped
 from sensor_msgs.msg import Joy
 import numpy as np
+import sys
+import os
+import time
+import rospkg
 
+# add the include path of the package so that interpeter can find the modules
+sys.path.append(os.path.join(rospkg.RosPack().get_path('vehicle_control'), 'include'))
+
+from param_cache import node_param_cache, JOY_PARAMS
+from latency_stats import LatencyStats
+from latency_diagnostics import node_latency_diagnostics
 
 def get_interp(x_vals, y_vals):     
    return lambda x: np.interp(x, x_vals, y_vals)
 
 class JoyControl:
 
-    def __init__(self):
+    def __init__(self, subscribe = True, publish = True):
+        """subscribe/publish: use /rc/joy (or /joy) and /rc/ackermann_cmd, the fused pipeline passes messages in-process instead."""
 
         # select control type
         self.control_types = ['joy', 'rc']  # [joystick, remote control]
@@ -26,55 +37,83 @@ class JoyControl:
         else:
             rospy.loginfo("control_type: %s", self.control_type)
 
-        # load parameters
+        # load parameters as one immutable snapshot, swapped in together with the mapping built from it
+        self.params = node_param_cache('JoyConfig', JOY_PARAMS, self.derive_params)
         self.load_params()
 
         # define messages
         self.ackMsg = AckermannDriveStamped()
 
+        # in-process consumers of the ackermann message (fused pipeline), called before publishing
+        self.sinks = []
+        self.publish = publish
+
+        # per stage latency, input_age is the time from the origin stamp of the joy message to this callback
+        self.stages = {name: LatencyStats(name) for name in ('input_age', 'joy_mapping', 'publish')}
+
         # publish ackermann messages to VESC
-        self.ackermann_pub = rospy.Publisher('/rc/ackermann_cmd', AckermannDriveStamped, queue_size=1) 
+        self.ackermann_pub = rospy.Publisher('/rc/ackermann_cmd', AckermannDriveStamped, queue_size=1) if publish else None
 
         # subscribe to joy
-        if self.control_type == 'rc':
+        self.joy_sub = None
+        if subscribe and self.control_type == 'rc':
             self.joy_sub = rospy.Subscriber('/rc/joy', Joy, self.callback)
-        elif self.control_type == 'joy':
+        elif subscribe and self.control_type == 'joy':
             self.joy_sub = rospy.Subscriber('/joy', Joy, self.callback)
 
     def callback(self, msg):
 
-        steering_val = msg.axes[self.steer_ax]
-        speed_val = msg.axes[self.speed_ax]
+        # keep the origin stamp (rc receipt or joy_node) so the latency can be traced down to the vesc commands
+        origin = msg.header.stamp
+        if origin.is_zero():
+            origin = rospy.Time.now()
+        else:
+            self.stages['input_age'].record((rospy.Time.now() - origin).to_sec())
+
+        t0 = time.perf_counter()
+        steer_ax, speed_ax, steer_mapping, speed_mapping = self.params.derived # read once, swapped atomically on param changes
 
-        steering_angle = self.steer_mapping(steering_val)
-        speed = self.speed_mapping(speed_val)
+        steering_val = msg.axes[steer_ax]
+        speed_val = msg.axes[speed_ax]
 
-        self.ackMsg.header.stamp = rospy.Time.now()
+        steering_angle = steer_mapping(steering_val)
+        speed = speed_mapping(speed_val)
+
+        self.ackMsg.header.stamp = origin
         self.ackMsg.drive.steering_angle = steering_angle
         self.ackMsg.drive.speed = speed
+        self.stages['joy_mapping'].record(time.perf_counter() - t0)
+
+        for sink in self.sinks:
+            sink(self.ackMsg)
 
-        self.ackermann_pub.publish(self.ackMsg)
+        if self.publish:
+            t0 = time.perf_counter()
+            self.ackermann_pub.publish(self.ackMsg)
+            self.stages['publish'].record(time.perf_counter() - t0)
 
 
     def load_params(self):
       
-        # load parameters
+        # load parameters in one call, the mapping is only rebuilt if a value changed
+        self.params.refresh()
 
-        if self.control_type == 'rc':
-            self.steer_ax = rospy.get_param("/rc_steering_axis")
-            self.speed_ax = rospy.get_param("/rc_speed_axis")
+    def derive_params(self, cfg, old):
+
+        if self.control_type == 'joy':
+            steer_ax, speed_ax = cfg.joy_steer_ax, cfg.joy_speed_ax
+        else:
+            steer_ax, speed_ax = cfg.rc_steer_ax, cfg.rc_speed_ax
 
-        elif self.control_type == 'joy':
-            self.steer_ax = rospy.get_param("/joy_steering_axis")
-            self.speed_ax = rospy.get_param("/joy_speed_axis")
+        # fail at startup instead of a TypeError in every callback
+        if steer_ax is None or speed_ax is None:
+            raise ValueError('Missing steering or speed axis parameter for control type %s.' % self.control_type)
 
-        steer_max = rospy.get_param("/steering_angle_max")
+        steer_mapping = get_interp((-1.0, 0.0, 1.0), (-cfg.steer_max, 0, cfg.steer_max))
+        speed_mapping = get_interp((-1.0, 0.0, 1.0), (cfg.speed_min, 0, cfg.speed_max))
 
-        speed_min = rospy.get_param("/speed_min")
-        speed_max = rospy.get_param("/speed_max")
-    
-        self.steer_mapping = get_interp((-1.0, 0.0, 1.0), (-steer_max, 0, steer_max))
-        self.speed_mapping = get_interp((-1.0, 0.0, 1.0), (speed_min, 0, speed_max))
+        # swapped in together with the snapshot
+        return (steer_ax, speed_ax, steer_mapping, speed_mapping)
         
 if __name__ == '__main__':
 
@@ -82,6 +121,7 @@ if __name__ == '__main__':
     rospy.init_node('joy_control', anonymous=True)
 
     ctrl = JoyControl()
+    diagnostics = node_latency_diagnostics(ctrl.stages)
 
     try:
         rospy.spin()
@@ -5,38 +5,31 @@ from std_msgs.msg import UInt16MultiArray
 from sensor_msgs.msg import Joy
 import numpy as np
 import sys
+import os
+import time
 import rospkg
 
-def get_interp(x_vals, y_vals, thresholds = None):
+# add the include path of the package so that interpeter can find the modules
+sys.path.append(os.path.join(rospkg.RosPack().get_path('vehicle_control'), 'include'))
 
-   if thresholds is None:
-      return lambda x: np.interp(x, x_vals, y_vals)
-   
-   x_expanded, y_expanded = [], []
-   for x,y,t in zip(x_vals, y_vals, thresholds):
-      if t:
-         x = [x-t/2, x, x+t/2]
-         y = [y, y, y]
-      else:
-         x, y = [x], [y]
-
-      x_expanded.extend(x)
-      y_expanded.extend(y)
-
-      
-   return lambda x: np.interp(x, x_expanded, y_expanded)
+from param_cache import node_param_cache, RC_PARAMS
+from pwm_lut import PwmDecoder
+from latency_stats import LatencyStats
+from latency_diagnostics import node_latency_diagnostics
 
 
 class RCJoystick:
 
-   def __init__(self):
+   def __init__(self, subscribe = True, publish = True):
+      """subscribe/publish: use /veh_remote_ctrl and /rc/joy, the fused pipeline passes messages in-process instead."""
       
       # define thresholds
       self.mode_threshold = (100, 100, 100)
       self.steer_threshold = (0, 10, 0)
       self.speed_threshold = (0, 20, 0)
       
-      # load parameters
+      # load parameters as one immutable snapshot, swapped in together with the decoder built from it
+      self.params = node_param_cache('RCConfig', RC_PARAMS, self.derive_params)
       self.load_params()
       
       # define messages
@@ -46,69 +39,81 @@ class RCJoystick:
       self.joy_msg.axes = [0.0, 0.0] # init
       self.joy_msg.buttons = [0]
       
-      # subscribe to pwm signals from rc receiver
-      self.rc_sub = rospy.Subscriber('/veh_remote_ctrl', UInt16MultiArray, self.callback) # 20hz
+      # in-process consumers of the joy message (fused pipeline), called before publishing
+      self.sinks = []
+      self.publish = publish
+
+      # per stage latency, published on /diagnostics by the node
+      self.stages = {name: LatencyStats(name) for name in ('pwm_decode', 'publish')}
 
       # publish joy message
-      self.rc_pub = rospy.Publisher('/rc/joy', Joy, queue_size=1) 
+      self.rc_pub = rospy.Publisher('/rc/joy', Joy, queue_size=1) if publish else None
 
-   def parse_pwm(self, pwm_signal):
+      # subscribe to pwm signals from rc receiver
+      self.rc_sub = rospy.Subscriber('/veh_remote_ctrl', UInt16MultiArray, self.callback) if subscribe else None # 20hz
 
-      steer_pwm, speed_pwm, mode_pwm = pwm_signal
-      steer_val, speed_val, mode_val = 0, 0, 0 # init
+   def parse_pwm(self, pwm_signal, decoder = None):
 
-      # connection lost if pwm = 0
-      if 0 in pwm_signal:
-         return steer_val, speed_val, mode_val
-      
+      # one table index per channel, (0, 0, 0) if the connection is lost (pwm = 0)
+      steer_pwm, speed_pwm, mode_pwm = pwm_signal
+      return (decoder or self.decoder).decode(steer_pwm, speed_pwm, mode_pwm)
 
-      steer_val = self.steer_mapping(steer_pwm)
-      speed_val = self.speed_mapping(speed_pwm)
-      mode_val = int(self.mode_mapping(mode_pwm))
-         
-      return steer_val, speed_val, mode_val
+   def parse_pwm_batch(self, pwm_signals):
+      # decode many pwm triples at once, e.g. for log replay
+      return self.decoder.decode_batch(pwm_signals)
 
    def callback(self,data):
 
-      steer_val, throt_val, mode_val = self.parse_pwm(data.data)
+      # UInt16MultiArray has no header, the receipt time is the origin stamp of the whole command chain
+      origin = rospy.Time.now()
+
+      cfg, decoder = self.params.current # snapshot and matching decoder, read once
+      t0 = time.perf_counter()
+      steer_val, throt_val, mode_val = self.parse_pwm(data.data, decoder)
       
-      self.joy_msg.axes[self.steer_ax] = steer_val
-      self.joy_msg.axes[self.speed_ax] = throt_val
+      self.joy_msg.axes[cfg.steer_ax] = steer_val
+      self.joy_msg.axes[cfg.speed_ax] = throt_val
       
-      self.joy_msg.buttons[self.mode_btn] = mode_val
+      self.joy_msg.buttons[cfg.mode_btn] = mode_val
+      self.stages['pwm_decode'].record(time.perf_counter() - t0)
       
-      self.joy_msg.header.stamp = rospy.Time.now()
+      self.joy_msg.header.stamp = origin
       self.joy_msg.header.seq += 1
 
+      for sink in self.sinks:
+         sink(self.joy_msg)
+
+      if not self.publish:
+         return
+
+      t0 = time.perf_counter()
       try:
          self.rc_pub.publish(self.joy_msg)
       except Exception as e:
          print(e)
+      self.stages['publish'].record(time.perf_counter() - t0)
          
 
    def load_params(self):
       
-      # load parameters
-      steer_min_pwm = rospy.get_param("/steering_min_pwm")
-      steer_mid_pwm = rospy.get_param("/steering_mid_pwm")
-      steer_max_pwm = rospy.get_param("/steering_max_pwm")
-
-      speed_min_pwm = rospy.get_param("/speed_min_pwm")
-      speed_mid_pwm = rospy.get_param("/speed_mid_pwm")
-      speed_max_pwm = rospy.get_param("/speed_max_pwm")
-
-      mode_min_pwm = rospy.get_param("/mode_min_pwm")
-      mode_mid_pwm = rospy.get_param("/mode_mid_pwm")
-      mode_max_pwm = rospy.get_param("/mode_max_pwm")
-
-      self.steer_ax = rospy.get_param("/rc_steering_axis")
-      self.speed_ax = rospy.get_param("/rc_speed_axis")
-      self.mode_btn = rospy.get_param("/rc_mode_button")
-      
-      # add +/- threshold 
-      self.steer_mapping = get_interp((steer_min_pwm, steer_mid_pwm, steer_max_pwm), (-1.0, 0.0, 1.0), self.steer_threshold)
-      self.speed_mapping = get_interp((speed_min_pwm, speed_mid_pwm, speed_max_pwm), (-1.0, 0.0, 1.0), self.speed_threshold)
-      self.mode_mapping = get_interp((mode_min_pwm, mode_mid_pwm, mode_max_pwm), (0, 1, 2), self.mode_threshold)
+      # load parameters in one call, the mappings are only rebuilt if a value changed
+      self.params.refresh()
+
+   def derive_params(self, cfg, old):
+
+      # dense lookup tables with the +/- thresholds baked in, only rebuilt if the pwm params change
+      return PwmDecoder(
+         ((cfg.steer_min_pwm, cfg.steer_mid_pwm, cfg.steer_max_pwm), (-1.0, 0.0, 1.0), self.steer_threshold),
+         ((cfg.speed_min_pwm, cfg.speed_mid_pwm, cfg.speed_max_pwm), (-1.0, 0.0, 1.0), self.speed_threshold),
+         ((cfg.mode_min_pwm, cfg.mode_mid_pwm, cfg.mode_max_pwm), (0, 1, 2), self.mode_threshold))
+
+   @property
+   def cfg(self):
+      return self.params.snapshot
+
+   @property
+   def decoder(self):
+      return self.params.derived
 
 if __name__ == '__main__':
 
@@ -116,6 +121,7 @@ if __name__ == '__main__':
   rospy.init_node('rc_joystick', anonymous=True)
 
   rcjoy = RCJoystick()
+  diagnostics = node_latency_diagnostics(rcjoy.stages)
 
   try:
     rospy.spin()
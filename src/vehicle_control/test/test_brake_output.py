@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'include'))
+
+from brake_control import BrakeScheduler
+from vesc_output import VescOutput
+
+
+class TestBrakeOutput(unittest.TestCase):
+    """The motor channel belongs to the brake pulses while a brake runs, no speed command is written in between."""
+
+    def setUp(self):
+        self.writes = [] # (kind, value) in publish order
+        self.lock = threading.Lock()
+        self.brakes = BrakeScheduler(lambda: self.write('pulse', 5.0), hz = 420, duration = 0.2)
+        self.output = VescOutput(lambda v: self.write('servo', v), lambda v: self.write('erpm', v),
+                                 lambda v: self.write('brake', v), hold_motor = lambda: self.brakes.active)
+
+    def tearDown(self):
+        self.brakes.shutdown()
+
+    def write(self, kind, value):
+        with self.lock:
+            self.writes.append((kind, value))
+
+    def drive(self, seconds, erpm):
+        # planner commands at 200 Hz into the 50 Hz output stage
+        end = time.monotonic() + seconds
+        i = 0
+        while time.monotonic() < end:
+            self.output.submit(0.5, erpm + i, None)
+            if i % 4 == 3:
+                self.output.flush()
+            i += 1
+            time.sleep(0.005)
+
+    def test_no_speed_write_during_brake(self):
+        self.drive(0.05, 3000.0)
+        self.output.submit(0.5, 3000.0, None) # pending from before the brake, must not be flushed during it
+        self.brakes.start()
+        self.drive(0.3, 3000.0) # the brake ends in the middle
+
+        kinds = [kind for kind, _ in self.writes]
+        first, last = kinds.index('pulse'), len(kinds) - 1 - kinds[::-1].index('pulse')
+        self.assertEqual(kinds.count('pulse'), 84)
+        self.assertNotIn('erpm', kinds[first:last])
+        self.assertNotIn('brake', kinds[first:last])
+        self.assertIn('servo', kinds[first:last]) # steering is still written
+        self.assertIn('erpm', kinds[last:]) # speed commands resume after the brake
+        self.assertGreater(self.output.held, 0)
+
+    def test_passthrough_during_brake(self):
+        self.output.passthrough = True
+        self.brakes.start()
+        while self.brakes.active:
+            self.output.submit(0.5, 3000.0, None)
+            time.sleep(0.001)
+        self.output.submit(0.5, 3000.0, None)
+
+        kinds = [kind for kind, _ in self.writes]
+        self.assertEqual(kinds[-1], 'erpm')
+        self.assertNotIn('erpm', kinds[:-1])
+
+
+if __name__ == '__main__':
+    unittest.main()